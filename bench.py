@@ -0,0 +1,859 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The bot reads its configuration at import time, so point it at a scratch
+# database before importing it.
+_tmpdir = tempfile.TemporaryDirectory(prefix="bot-bench-")
+os.environ.setdefault("BOT_TOKEN", "bench")
+os.environ["DB_PATH"] = os.path.join(_tmpdir.name, "bot_database.db")
+
+import main
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name, count, elapsed, latencies=None):
+    print(f"{name}: {count} ops in {elapsed:.2f}s ({count / elapsed:.0f} ops/s)")
+    if latencies:
+        print(f"  p50 {percentile(latencies, 50) * 1000:.2f}ms  p99 {percentile(latencies, 99) * 1000:.2f}ms")
+
+
+# ==================== PURCHASE ====================
+async def _buyer(user_id, attempts, latencies, failures):
+    for _ in range(attempts):
+        started = time.perf_counter()
+        try:
+            await main.run_db(main.create_order, user_id, 'game', 1, 1)
+        except main.PurchaseError as e:
+            failures[str(e)] = failures.get(str(e), 0) + 1
+        latencies.append(time.perf_counter() - started)
+
+
+def bench_purchase(args):
+    main.init_db()
+    main.seed_db()
+    stock = args.stock
+    main.execute_query("UPDATE game_numbers SET stock = ?, price = 1 WHERE id = 1", (stock,))
+    main.execute_many(
+        "INSERT OR IGNORE INTO users (user_id, username, full_name, balance) VALUES (?, ?, ?, ?)",
+        [(uid, f"buyer{uid}", f"Buyer {uid}", args.attempts) for uid in range(1, args.buyers + 1)]
+    )
+    latencies, failures = [], {}
+
+    async def run():
+        await asyncio.gather(*(_buyer(uid, args.attempts, latencies, failures) for uid in range(1, args.buyers + 1)))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - started
+
+    orders = main.execute_query("SELECT COUNT(*) as count FROM orders")[0]['count']
+    left = main.execute_query("SELECT stock FROM game_numbers WHERE id = 1")[0]['stock']
+    report("purchase", len(latencies), elapsed, latencies)
+    print(f"  orders {orders}  stock left {left}  rejected {failures}")
+    if orders + left != stock or left < 0:
+        print("  ❌ stock accounting mismatch")
+        return 1
+    return 0
+
+
+# ==================== QUERY PLANS ====================
+# Hot lookups and the index each must use. A plan that falls back to a
+# full table scan (or a temp b-tree sort) is a regression.
+HOT_QUERIES = [
+    ("SELECT * FROM orders WHERE status = 'pending' ORDER BY order_date", (), "idx_orders_status_date"),
+    ("SELECT * FROM deposits WHERE status = 'pending' ORDER BY request_date", (), "idx_deposits_status_date"),
+    ("SELECT * FROM orders WHERE user_id = ? ORDER BY order_date DESC LIMIT ?", (1, 10), "idx_orders_user_date"),
+    ("SELECT * FROM users WHERE 1 = 1 AND (join_date, user_id) < (?, ?) ORDER BY join_date DESC, user_id DESC LIMIT ?",
+     ("2024-01-01", 1, 21), "idx_users_join_date"),
+    ("SELECT * FROM orders WHERE status = 'pending' AND (order_date, id) > (?, ?) ORDER BY order_date ASC, id ASC LIMIT ?",
+     ("2024-01-01", 1, 21), "idx_orders_status_date"),
+    ("SELECT * FROM deposits WHERE deposit_id = ?", ("DEP1",), "sqlite_autoindex_deposits_1"),
+    ("SELECT * FROM orders WHERE order_id = ?", ("ORD1",), "sqlite_autoindex_orders_1"),
+    ("SELECT bucket, key, count, amount FROM rollups_daily WHERE metric = ? AND bucket >= ? ORDER BY bucket, key",
+     ("sales:product", "2024-01-01"), "PRIMARY KEY"),
+    ("SELECT bucket, key, count, amount FROM rollups_hourly WHERE metric = ? AND bucket >= ? ORDER BY bucket, key",
+     ("sales:product", "2024-01-01 00:00"), "PRIMARY KEY"),
+]
+
+
+def bench_plans(args):
+    main.init_db()
+    failed = 0
+    for query, params, index in HOT_QUERIES:
+        plan = " | ".join(row['detail'] for row in main.execute_query(f"EXPLAIN QUERY PLAN {query}", params))
+        ok = index in plan and "TEMP B-TREE" not in plan
+        failed += not ok
+        print(f"{'✅' if ok else '❌'} {query}\n   {plan}")
+    return 1 if failed else 0
+
+
+# ==================== IDS ====================
+def _generate_ids(count):
+    new_id = main.id_generator.new_id
+    return [new_id("ORD") for _ in range(count)]
+
+
+def _insert_rate(ids):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, order_id TEXT UNIQUE)")
+    started = time.perf_counter()
+    conn.executemany("INSERT INTO t (order_id) VALUES (?)", ((i,) for i in ids))
+    conn.commit()
+    return len(ids) / (time.perf_counter() - started)
+
+
+def bench_ids(args):
+    started = time.perf_counter()
+    local = _generate_ids(args.count)
+    report("id generation", len(local), time.perf_counter() - started)
+    failed = 0
+    if local != sorted(local) or len(set(local)) != len(local):
+        print("  ❌ ids from one process are not strictly increasing")
+        failed = 1
+
+    # Forked workers generating at the same time must not collide
+    with multiprocessing.get_context("fork").Pool(args.processes) as pool:
+        batches = pool.map(_generate_ids, [args.count // args.processes] * args.processes)
+    combined = set(local)
+    total = len(local)
+    for batch in batches:
+        combined.update(batch)
+        total += len(batch)
+    print(f"  {total} ids across {args.processes + 1} processes, {total - len(combined)} duplicates")
+    if len(combined) != total:
+        failed = 1
+
+    sample = local[:args.insert_sample]
+    shuffled = sorted(sample, key=lambda i: hash(i))
+    print(f"  unique index inserts: {_insert_rate(sample):.0f}/s sequential, {_insert_rate(shuffled):.0f}/s random order")
+    return failed
+
+
+# ==================== INVENTORY IMPORT ====================
+def bench_import(args):
+    main.init_db()
+    main.seed_db()
+    initial_stock = main.execute_query("SELECT stock FROM telegram_accounts WHERE id = 1")[0]['stock']
+    path = os.path.join(_tmpdir.name, "stock.csv")
+    with open(path, "w") as f:
+        f.write("phone_number,details\n")
+        for i in range(args.rows):
+            # Every 20th row repeats an earlier number, every 50th is malformed
+            number = i - 1 if i % 20 == 19 else i
+            phone = "not-a-number" if i % 50 == 49 else f"+91{7000000000 + number}"
+            f.write(f"{phone},batch {i // 1000}\n")
+
+    started = time.perf_counter()
+    report = main.import_inventory(path, 'telegram', 1)
+    elapsed = time.perf_counter() - started
+    report_line = main.format_import_report(report)
+    print(f"import: {report['read']} rows in {elapsed:.2f}s ({report['read'] / elapsed:.0f} rows/s)\n  {report_line}")
+
+    # Importing the same file again must add nothing
+    again = main.import_inventory(path, 'telegram', 1)
+    stock = main.execute_query("SELECT stock FROM telegram_accounts WHERE id = 1")[0]['stock']
+    items = main.execute_query("SELECT COUNT(*) as count FROM inventory_items")[0]['count']
+    print(f"  re-import added {again['inserted']}, inventory {items}, stock {initial_stock} -> {stock}")
+    # The stock counter grows by exactly the number of new items
+    return 1 if again['inserted'] or items != report['inserted'] or stock != initial_stock + report['inserted'] else 0
+
+
+# ==================== FAKE BOT API ====================
+# A local stand-in for api.telegram.org: answers getMe/setWebhook and
+# records every sendMessage so runs never reach Telegram.
+class FakeBotAPI:
+    def __init__(self):
+        self.calls = {}
+        self.sent = 0
+        self.texts = []
+        self._lock = threading.Lock()
+        self._sent_changed = threading.Condition(self._lock)
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                method = self.path.rsplit('/', 1)[-1]
+                params = api.parse(body, self.headers.get('Content-Type', ''))
+                payload = json.dumps({"ok": True, "result": api.handle(method, params)}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    @staticmethod
+    def parse(body, content_type):
+        if not body:
+            return {}
+        if 'json' in content_type:
+            return json.loads(body)
+        return {key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+
+    def handle(self, method, params):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if method == 'sendMessage':
+                self.sent += 1
+                self.texts.append((int(params.get('chat_id', 0)), params.get('text', '')))
+                self._sent_changed.notify_all()
+        if method == 'getMe':
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == 'sendMessage':
+            return {
+                "message_id": self.sent, "date": int(time.time()),
+                "chat": {"id": int(params.get('chat_id', 0)), "type": "private"},
+                "text": params.get('text', '')
+            }
+        if method == 'getUpdates':
+            time.sleep(0.1)
+            return []
+        return True
+
+    def wait_for_sent(self, count, timeout):
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self.sent < count and time.monotonic() < deadline:
+                self._sent_changed.wait(deadline - time.monotonic())
+            return self.sent
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def make_update(update_id, user_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        "text": text,
+    }
+    if text.startswith('/'):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+# Runs main.py as a separate process in webhook mode against the fake API
+class WebhookBot:
+    def __init__(self, api, secret="bench-secret", extra_env=None, command=()):
+        self.port = free_port()
+        self.secret = secret
+        self.url = f"http://127.0.0.1:{self.port}/telegram"
+        env = dict(
+            os.environ,
+            BOT_MODE="webhook",
+            BOT_API_URL=api.url,
+            WEBHOOK_LISTEN="127.0.0.1",
+            WEBHOOK_PORT=str(self.port),
+            WEBHOOK_URL=f"http://127.0.0.1:{self.port}",
+            WEBHOOK_PATH="telegram",
+            WEBHOOK_SECRET=secret,
+        )
+        env.update(extra_env or {})
+        self.process = subprocess.Popen([sys.executable, main.__file__, *command], env=env)
+
+    def wait_ready(self):
+        return wait_for_port(self.port)
+
+    def post(self, update, secret=None):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(update).encode(),
+            headers={
+                'Content-Type': 'application/json',
+                'X-Telegram-Bot-Api-Secret-Token': secret or self.secret,
+            },
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+# ==================== STARTUP ====================
+def _median_run(argv, runs, env=None):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(argv, env=env, check=True, stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - started)
+    return percentile(samples, 50) * 1000
+
+
+def bench_startup(args):
+    python = sys.executable
+    baseline = _median_run([python, "-c", "pass"], args.runs)
+    print(f"interpreter          {baseline:8.1f} ms")
+    for label, code in (
+        ("import main", "import main"),
+        ("import main + ext", "import main, telegram.ext"),
+    ):
+        elapsed = _median_run([python, "-c", code], args.runs)
+        print(f"{label:<20} {elapsed:8.1f} ms  ({elapsed - baseline:.1f} ms over the interpreter)")
+
+    started = time.perf_counter()
+    version = main.init_db()
+    fresh = (time.perf_counter() - started) * 1000
+    main.seed_db()
+    samples = []
+    for _ in range(args.runs):
+        main.close_db()
+        started = time.perf_counter()
+        main.init_db()
+        samples.append(time.perf_counter() - started)
+    print(f"init_db fresh        {fresh:8.2f} ms  (schema version {version})")
+    print(f"init_db current      {percentile(samples, 50) * 1000:8.2f} ms")
+    main.close_db()
+
+    api = FakeBotAPI()
+    api.start()
+    samples = []
+    try:
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            bot = WebhookBot(api)
+            try:
+                if not bot.wait_ready():
+                    print("❌ bot did not start listening")
+                    return 1
+                samples.append(time.perf_counter() - started)
+            finally:
+                bot.stop()
+    finally:
+        api.stop()
+    ready = percentile(samples, 50) * 1000
+    print(f"webhook ready        {ready:8.1f} ms")
+    if args.max_ready_ms and ready > args.max_ready_ms:
+        print(f"❌ startup slower than {args.max_ready_ms:.0f} ms")
+        return 1
+    return 0
+
+
+# ==================== WEBHOOK ====================
+def bench_webhook(args):
+    main.init_db()
+    main.seed_db()
+    main.close_db()
+    api = FakeBotAPI()
+    api.start()
+    bot = WebhookBot(api, extra_env={"CONCURRENT_UPDATES": str(args.concurrency)})
+    try:
+        if not bot.wait_ready():
+            print("❌ webhook server did not start")
+            return 1
+        if bot.post(make_update(0, 1, "/start"), secret="wrong") != 403:
+            print("❌ update with a bad secret token was accepted")
+            return 1
+        return 1 if post_updates(api, bot, args, "webhook") else 0
+    finally:
+        bot.stop()
+        api.stop()
+
+
+# Every user sends /start, then My Orders until args.updates are sent; each
+# update gets exactly one reply. Returns True when any update went unanswered.
+def post_updates(api, bot, args, label):
+    baseline = api.sent
+    updates = []
+    for i in range(args.updates):
+        user_id = 100000 + i % args.users
+        text = "/start" if i < args.users else "📜 My Orders"
+        updates.append(make_update(i + 1, user_id, text))
+
+    latencies = []
+
+    def post(update):
+        started = time.perf_counter()
+        status = bot.post(update)
+        latencies.append(time.perf_counter() - started)
+        return status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        statuses = list(pool.map(post, updates))
+    accepted = time.perf_counter() - started
+    replies = api.wait_for_sent(baseline + len(updates), timeout=args.timeout) - baseline
+    elapsed = time.perf_counter() - started
+
+    report(f"{label} ingress", len(updates), accepted, latencies)
+    report(f"{label} end-to-end", replies, elapsed)
+    rejected = sum(status != 200 for status in statuses)
+    if rejected or replies < len(updates):
+        print(f"  ❌ {rejected} rejected, {len(updates) - replies} unanswered")
+        return True
+    return False
+
+
+# ==================== SHARDS ====================
+# The same traffic through `main.py serve-shards`, then an admin approving
+# a page of deposits that live in every shard, which only works if the
+# admin's worker reaches the other shards.
+ADMIN_APPROVAL = ("/start", "🔧 Admin Panel", "💰 Pending Deposits", "✅ Approve Batch", "page")
+
+
+def free_port_range(count):
+    while True:
+        base = free_port()
+        try:
+            for port in range(base, base + count):
+                with socket.socket() as sock:
+                    sock.bind(('127.0.0.1', port))
+            return base
+        except OSError:
+            continue
+
+
+def bench_shards(args):
+    shard_paths = [f"{os.path.splitext(main.DB_PATH)[0]}.shard{shard}.db" for shard in range(args.shards)]
+    api = FakeBotAPI()
+    api.start()
+    main.SHARD_BASE_PORT = free_port_range(args.shards)
+    main.SHARD_SECRET = "bench-shard-secret"
+    bot = WebhookBot(api, command=("serve-shards",), extra_env={
+        "SHARD_COUNT": str(args.shards),
+        "SHARD_BASE_PORT": str(main.SHARD_BASE_PORT),
+        "SHARD_SECRET": main.SHARD_SECRET,
+        "CONCURRENT_UPDATES": str(args.concurrency),
+        "ADMIN_PAGE_SIZE": "100",
+    })
+    try:
+        if not bot.wait_ready():
+            print("❌ ingress did not start")
+            return 1
+        failed = post_updates(api, bot, args, f"{args.shards} shards")
+
+        users = {}
+        for shard, path in enumerate(shard_paths):
+            with sqlite3.connect(path) as conn:
+                ids = [row[0] for row in conn.execute("SELECT user_id FROM users")]
+            users[shard] = len(ids)
+            if any(user_id % args.shards != shard for user_id in ids):
+                print(f"  ❌ shard {shard} holds users it does not own")
+                failed = True
+        print(f"  users per shard {users}")
+
+        # Two pending deposits for users of every shard, approved by the admin
+        deposits = {}
+        for i in range(2 * args.shards):
+            user_id = 100000 + i
+            path = shard_paths[user_id % args.shards]
+            deposit_id = main.new_deposit_id()
+            with sqlite3.connect(path) as conn:
+                conn.execute(
+                    "INSERT INTO deposits (deposit_id, user_id, amount, method) VALUES (?, ?, 100, 'upi')",
+                    (deposit_id, user_id)
+                )
+            deposits[deposit_id] = path
+        admin_id = main.ADMIN_IDS[0]
+        for i, text in enumerate(ADMIN_APPROVAL):
+            bot.post(make_update(args.updates + 1 + i, admin_id, text))
+        deadline = time.monotonic() + args.timeout
+        while True:
+            approved = 0
+            for deposit_id, path in deposits.items():
+                with sqlite3.connect(path) as conn:
+                    approved += conn.execute(
+                        "SELECT status = 'approved' FROM deposits WHERE deposit_id = ?", (deposit_id,)
+                    ).fetchone()[0]
+            if approved == len(deposits) or time.monotonic() > deadline:
+                break
+            time.sleep(0.2)
+        print(f"  {'✅' if approved == len(deposits) else '❌'} admin approved {approved}/{len(deposits)} deposits across shards")
+        failed |= approved != len(deposits)
+
+        # An order in every shard, delivered by asking each worker in turn
+        # the way complete_order does from inside a worker
+        orders = {}
+        for shard, path in enumerate(shard_paths):
+            order_id = main.new_order_id()
+            with sqlite3.connect(path) as conn:
+                conn.execute(
+                    "INSERT INTO orders (order_id, user_id, product_type, product_id, amount) VALUES (?, ?, 'game', 1, 10)",
+                    (order_id, shard)
+                )
+            orders[order_id] = path
+        delivered = 0
+        for order_id, path in orders.items():
+            answers = [main.call_shard(shard, 'complete_order', order_id=order_id, admin_id=admin_id)
+                       for shard in range(args.shards)]
+            with sqlite3.connect(path) as conn:
+                status = conn.execute("SELECT status FROM orders WHERE order_id = ?", (order_id,)).fetchone()[0]
+            delivered += answers.count(True) == 1 and status == 'delivered'
+        print(f"  {'✅' if delivered == len(orders) else '❌'} delivered {delivered}/{len(orders)} orders through their shard")
+        failed |= delivered != len(orders)
+
+        # A broadcast from the admin reaches the users of every shard, and
+        # each shard's report reaches the admin through shard 0
+        recipients = set()
+        for path in shard_paths:
+            with sqlite3.connect(path) as conn:
+                recipients.update(row[0] for row in conn.execute("SELECT user_id FROM users"))
+        broadcast = "bench broadcast"
+        for i, text in enumerate(("📢 Broadcast", broadcast)):
+            bot.post(make_update(args.updates + len(ADMIN_APPROVAL) + 1 + i, admin_id, text))
+        deadline = time.monotonic() + args.timeout
+        while True:
+            reached = {chat_id for chat_id, text in list(api.texts) if broadcast in text.split("\n\n")}
+            reports = sum(text.count("Broadcast queued") for chat_id, text in list(api.texts) if chat_id == admin_id)
+            if (reached >= recipients and reports == args.shards) or time.monotonic() > deadline:
+                break
+            time.sleep(0.2)
+        ok = reached >= recipients and reports == args.shards
+        print(f"  {'✅' if ok else '❌'} broadcast reached {len(reached & recipients)}/{len(recipients)} users, "
+              f"{reports}/{args.shards} shard reports")
+        failed |= not ok
+        return 1 if failed else 0
+    finally:
+        bot.stop()
+        api.stop()
+
+
+# ==================== SHARD WRITES ====================
+# One writer process per shard, all starting at the same moment, each
+# creating users, crediting them and filing deposits in its own shard. The
+# shards share nothing but the attached catalog, so their writes must not
+# wait on each other. --immediate puts back BEGIN IMMEDIATE, which also
+# write-locks the catalog, for comparison.
+SHARD_WRITER = """
+import sys, json, time, sqlite3
+import main
+if sys.argv[3] == "immediate":
+    _transaction = main.transaction
+    main.transaction = lambda immediate=False: _transaction(immediate=True)
+main.init_db()
+start, seconds = float(sys.argv[1]), float(sys.argv[2])
+time.sleep(max(0.0, start - time.time()))
+latencies = []
+errors = 0
+user_id = main.SHARD_ID
+while time.time() < start + seconds:
+    for write in (
+        lambda: main.create_user(user_id, "bench", "Bench User"),
+        lambda: main.update_balance(user_id, 100),
+        lambda: main.create_deposit(user_id, 100, "upi"),
+    ):
+        began = time.perf_counter()
+        try:
+            write()
+        except sqlite3.OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - began)
+    user_id += main.SHARD_COUNT
+print(json.dumps({"latencies": latencies, "errors": errors}))
+"""
+
+
+def _run_shard_writers(shards, seconds, mode):
+    workdir = tempfile.mkdtemp(prefix=f"{shards}-{mode}-", dir=_tmpdir.name)
+    env = dict(os.environ, DB_PATH=os.path.join(workdir, "bot_database.db"), SHARD_COUNT=str(shards))
+    start = time.time() + 2 + 0.2 * shards
+    writers = [
+        subprocess.Popen(
+            [sys.executable, "-c", SHARD_WRITER, str(start), str(seconds), mode],
+            env=dict(env, SHARD_ID=str(shard)), stdout=subprocess.PIPE, text=True,
+            cwd=os.path.dirname(os.path.abspath(main.__file__)),
+        )
+        for shard in range(shards)
+    ]
+    results = [json.loads(writer.communicate()[0]) for writer in writers]
+    return [t for r in results for t in r['latencies']], sum(r['errors'] for r in results)
+
+
+def bench_shard_writes(args):
+    failed = False
+    runs = [(1, "deferred"), (args.shards, "deferred")]
+    if args.immediate:
+        runs.append((args.shards, "immediate"))
+    rates = {}
+    for shards, mode in runs:
+        latencies, errors = _run_shard_writers(shards, args.seconds, mode)
+        rates[shards, mode] = len(latencies) / args.seconds
+        report(f"{shards} shard(s), BEGIN {mode.upper()}", len(latencies), args.seconds, latencies)
+        print(f"  slowest {max(latencies) * 1000:.0f}ms, {errors} lock errors")
+        if errors and mode == "deferred":
+            print("  ❌ shard-local writes hit a lock")
+            failed = True
+    print(f"  {args.shards} shards vs 1: {rates[args.shards, 'deferred'] / rates[1, 'deferred']:.2f}x "
+          f"on {os.cpu_count()} CPU(s)")
+    return 1 if failed else 0
+
+
+# ==================== LOAD ====================
+# End-to-end load test: thousands of simulated users drive the real
+# handlers in-process, through the bot's update processor, while every Bot
+# API call goes to the fake server. Deposits are approved by a simulated
+# admin in batches and users then buy with the credited balance.
+LOAD_SESSION = ("/start", "👤 My Profile", "📜 My Orders", "💰 Add Balance", "🔙 Main Menu")
+
+
+class LoadRun:
+    def __init__(self, application):
+        self.application = application
+        self.latencies = {}
+        self.outcomes = {}
+        self.update_id = 0
+
+    def record(self, step, started):
+        self.latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+    def count(self, outcome):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    async def send(self, user_id, text):
+        self.update_id += 1
+        update = main.Update.de_json(make_update(self.update_id, user_id, text), self.application.bot)
+        started = time.perf_counter()
+        await self.application.update_processor.process_update(update, self.application.process_update(update))
+        self.record(text, started)
+
+    async def call(self, step, func, *args):
+        started = time.perf_counter()
+        try:
+            return await main.run_db(func, *args)
+        except main.PurchaseError as e:
+            self.count(f"{step}: {e}")
+        finally:
+            self.record(step, started)
+
+    async def user_session(self, user_id, purchases, price):
+        for text in LOAD_SESSION:
+            await self.send(user_id, text)
+        await self.call("create_deposit", main.create_deposit, user_id, price * purchases, "upi")
+        for _ in range(purchases):
+            # Give the admin a moment to approve the deposit first
+            for _ in range(50):
+                if main.user_cache.get(user_id) and main.user_cache.get(user_id).balance >= price:
+                    break
+                await asyncio.sleep(0.05)
+            if await self.call("create_order", main.create_order, user_id, 'game', 1, price):
+                self.count("orders")
+
+    async def admin_approvals(self, done, batch):
+        while not done.is_set() or main.get_system_stats()['pending_deposits']:
+            page = await main.run_db(main.get_page, 'pending_deposits', None, batch)
+            ids = [row['deposit_id'] for row in page['rows']]
+            if ids:
+                await self.call("approve_batch", main.process_deposits, ids, main.ADMIN_IDS[0])
+            else:
+                await asyncio.sleep(0.05)
+
+
+async def _run_load(args, api):
+    main.BOT_API_URL = api.url
+    application = main.build_application()
+    run = LoadRun(application)
+    price = 50
+    async with application:
+        await main.post_init(application)
+        await main.run_db(main.update_stock, 'game', 1, args.users * args.purchases)
+        sessions = asyncio.Semaphore(args.concurrency)
+        done = asyncio.Event()
+
+        async def session(user_id):
+            async with sessions:
+                await run.user_session(user_id, args.purchases, price)
+
+        started = time.perf_counter()
+        approvals = asyncio.create_task(run.admin_approvals(done, 200))
+        await asyncio.gather(*(session(200000 + i) for i in range(args.users)))
+        done.set()
+        await approvals
+        elapsed = time.perf_counter() - started
+        await main.post_stop(application)
+        await main.post_shutdown(application)
+    return run, elapsed
+
+
+# Deliver every pending order, then compare the rollups with totals computed
+# straight from orders and deposits
+def _check_rollups():
+    started = time.perf_counter()
+    delivered = sum(main.complete_order(order['order_id'], 1) for order in list(main.get_pending_orders()))
+    report("deliver orders", delivered, time.perf_counter() - started)
+    expected = {
+        'sales:product': main.execute_query("SELECT COUNT(*) AS count, SUM(amount) AS amount FROM orders WHERE status = 'delivered'")[0],
+        'deposits:method': main.execute_query("SELECT COUNT(*) AS count, SUM(amount) AS amount FROM deposits WHERE status = 'approved'")[0],
+    }
+    failed = False
+    for grain in main.ROLLUP_GRAINS:
+        for metric, totals in expected.items():
+            rows = main.get_rollup(metric, grain, "")
+            count, amount = sum(row['count'] for row in rows), sum(row['amount'] for row in rows)
+            ok = count == totals['count'] and abs(amount - (totals['amount'] or 0)) < 0.01
+            failed |= not ok
+            print(f"  {'✅' if ok else '❌'} {grain} {metric}: {count} / ₹{amount:.2f} (expected {totals['count']} / ₹{totals['amount'] or 0:.2f})")
+    return failed
+
+
+def bench_load(args):
+    main.init_db()
+    main.seed_db()
+    main.warm_catalog()
+    main.metrics.reset()
+    api = FakeBotAPI()
+    api.start()
+    try:
+        run, elapsed = asyncio.run(_run_load(args, api))
+    finally:
+        api.stop()
+
+    total = sum(len(samples) for samples in run.latencies.values())
+    report("load", total, elapsed)
+    worst = 0.0
+    for step, samples in sorted(run.latencies.items()):
+        p99 = percentile(samples, 99) * 1000
+        worst = max(worst, p99)
+        print(f"  {step:<16} n={len(samples):<6} p50 {percentile(samples, 50) * 1000:7.2f}ms  p99 {p99:7.2f}ms")
+    # Service time inside the bot, as opposed to the queueing seen above
+    latency = main.metrics.snapshot()['latency']
+    for name, summary in sorted(latency.items()):
+        if name.startswith(("handler:", "update:processing")):
+            print(f"  {name:<28} n={summary['count']:<6} p50 {summary['p50_ms']}ms  p99 {summary['p99_ms']}ms")
+    lock_wait = latency.get("db:write_lock_wait", {})
+    print(f"  db write-lock wait: n={lock_wait.get('count', 0)} p50 {lock_wait.get('p50_ms', 0)}ms "
+          f"p99 {lock_wait.get('p99_ms', 0)}ms total {lock_wait.get('total_ms', 0)}ms")
+    print(f"  bot api calls {api.calls}  outcomes {run.outcomes}")
+    sends = main.send_queue.stats()
+    print(f"  send queue {sends}")
+    if sends['dropped'] or sends['failed']:
+        print(f"  ❌ {sends['dropped']} messages dropped, {sends['failed']} failed")
+        return 1
+    drift = main.reconcile_stats()
+    if drift:
+        print(f"  ❌ stats drift {drift}")
+        return 1
+    if _check_rollups():
+        return 1
+    if args.max_p99_ms and worst > args.max_p99_ms:
+        print(f"  ❌ p99 {worst:.2f}ms exceeds {args.max_p99_ms}ms")
+        return 1
+    return 0
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the bot's hot paths")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    purchase = sub.add_parser("purchase", help="concurrent buyers against one product")
+    purchase.add_argument("--buyers", type=int, default=100)
+    purchase.add_argument("--attempts", type=int, default=20)
+    purchase.add_argument("--stock", type=int, default=1500)
+    purchase.set_defaults(func=bench_purchase)
+
+    plans = sub.add_parser("plans", help="fail if a hot query stops using its index")
+    plans.set_defaults(func=bench_plans)
+
+    ids = sub.add_parser("ids", help="generate and check order ids for collisions and ordering")
+    ids.add_argument("--count", type=int, default=2000000)
+    ids.add_argument("--processes", type=int, default=4)
+    ids.add_argument("--insert-sample", type=int, default=300000)
+    ids.set_defaults(func=bench_ids)
+
+    import_stock = sub.add_parser("import", help="bulk-load a generated stock file")
+    import_stock.add_argument("--rows", type=int, default=100000)
+    import_stock.set_defaults(func=bench_import)
+
+    load = sub.add_parser("load", help="simulated users through start, menus, deposits and purchases")
+    load.add_argument("--users", type=int, default=2000)
+    load.add_argument("--concurrency", type=int, default=100)
+    load.add_argument("--purchases", type=int, default=2)
+    load.add_argument("--max-p99-ms", type=float, default=0, help="fail when any step's p99 is slower")
+    load.set_defaults(func=bench_load)
+
+    webhook = sub.add_parser("webhook", help="post synthetic updates to the bot in webhook mode")
+    webhook.add_argument("--updates", type=int, default=2000)
+    webhook.add_argument("--users", type=int, default=200)
+    webhook.add_argument("--clients", type=int, default=32)
+    webhook.add_argument("--concurrency", type=int, default=64)
+    webhook.add_argument("--timeout", type=float, default=60)
+    webhook.set_defaults(func=bench_webhook)
+
+    startup = sub.add_parser("startup", help="import time, schema check and time until the webhook listens")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--max-ready-ms", type=float, default=0, help="fail when the bot takes longer to listen")
+    startup.set_defaults(func=bench_startup)
+
+    shards = sub.add_parser("shards", help="the webhook traffic through serve-shards worker processes")
+    shards.add_argument("--shards", type=int, default=os.cpu_count() or 2)
+    shards.add_argument("--updates", type=int, default=2000)
+    shards.add_argument("--users", type=int, default=200)
+    shards.add_argument("--clients", type=int, default=32)
+    shards.add_argument("--concurrency", type=int, default=64)
+    shards.add_argument("--timeout", type=float, default=60)
+    shards.set_defaults(func=bench_shards)
+
+    shard_writes = sub.add_parser("shard-writes", help="concurrent writer processes, one per shard")
+    shard_writes.add_argument("--shards", type=int, default=max(2, os.cpu_count() or 2))
+    shard_writes.add_argument("--seconds", type=float, default=5)
+    shard_writes.add_argument("--immediate", action="store_true", help="also run with the catalog write-locked by every transaction")
+    shard_writes.set_defaults(func=bench_shard_writes)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    finally:
+        main.close_db()
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
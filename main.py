@@ -1,25 +1,41 @@
+from __future__ import annotations
+
 import os
+import re
+import asyncio
+import argparse
 import logging
 import sqlite3
+import io
+import csv
 import json
-import random
+import base64
+import tempfile
 import string
-from datetime import datetime
+import time
+import bisect
+import threading
+import signal
+import socket
+import secrets
+import subprocess
+import sys
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from functools import lru_cache, wraps
+from datetime import datetime, timezone
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import (
-    Application,
-    CommandHandler,
-    MessageHandler,
-    filters,
-    ContextTypes,
-    ConversationHandler
-)
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from typing import TYPE_CHECKING
+
+# telegram.ext (and the webhook server it pulls in) is only needed to run the
+# bot; it is imported in build_application so CLI commands start quickly
+if TYPE_CHECKING:
+    from telegram.ext import ContextTypes
 
 # ==================== CONFIGURATION ====================
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-
-if not BOT_TOKEN:
-    raise RuntimeError("BOT_TOKEN not found in environment variables")
 ADMIN_IDS = [5678991839]
 DEFAULT_UPI = "yourupi@upi"
 DEFAULT_UPI_NAME = "Your Brand Name"
@@ -29,16 +45,211 @@ DEFAULT_CRYPTO = {
     "Bitcoin": "bc1q5q5q5q5q5q5q5q5q5q5q5q5q5q5q5q5q5q5q5q5q5q5q5"
 }
 
+# Update ingress: "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+BOT_API_URL = os.getenv("BOT_API_URL")  # alternative Bot API server, e.g. a local stand-in
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public base URL Telegram posts to
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+
+# Outbound messages, matched to Telegram's limits
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))  # messages per second, all chats
+SEND_CHAT_INTERVAL = float(os.getenv("SEND_CHAT_INTERVAL", "1"))  # seconds between messages to one chat
+SEND_MAX_PENDING = int(os.getenv("SEND_MAX_PENDING", "10000"))  # chats with queued messages
+SEND_MAX_CHAT_TEXTS = int(os.getenv("SEND_MAX_CHAT_TEXTS", "200"))  # queued messages for one chat
+ADMIN_FORWARD_INTERVAL = float(os.getenv("ADMIN_FORWARD_INTERVAL", "1"))  # seconds, shards > 0 to shard 0
+ADMIN_OUTBOX_SIZE = int(os.getenv("ADMIN_OUTBOX_SIZE", "10000"))  # alerts kept while shard 0 is unreachable
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+# Bot API connections; replies from concurrent updates and the send queue share them
+CONNECTION_POOL_SIZE = int(os.getenv("CONNECTION_POOL_SIZE", str(CONCURRENT_UPDATES + SEND_WORKERS)))
+MESSAGE_LIMIT = 4096
+
+# Instrumentation
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # local JSON endpoint, 0 = off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# Database
+DB_PATH = os.getenv("DB_PATH", "bot_database.db")
+DB_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "0")) or None  # seconds, None = until invalidated
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30"))  # seconds
+ACTIVITY_BUFFER_SIZE = int(os.getenv("ACTIVITY_BUFFER_SIZE", "20000"))  # users per flush at most
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "20"))
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "3600"))  # seconds, 0 = off
+
+# Sharded deployment (`python main.py serve-shards`): users are partitioned by
+# user_id % SHARD_COUNT over worker processes, each with its own database
+# file; the catalog (products, stock, payment methods) is one file that every
+# shard attaches. With SHARD_COUNT = 1 everything stays in DB_PATH. Each
+# file records the layout it belongs to; change SHARD_COUNT with
+# `python main.py reshard N`, which moves the data.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_ID = int(os.getenv("SHARD_ID", "0"))
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "8600"))  # worker i listens on 127.0.0.1:SHARD_BASE_PORT + i
+SHARD_SECRET = os.getenv("SHARD_SECRET", "")  # shared by the ingress and workers, generated by serve-shards
+_db_root, _db_ext = os.path.splitext(DB_PATH)
+CATALOG_DB_PATH = os.getenv("CATALOG_DB_PATH") or (f"{_db_root}.catalog{_db_ext}" if SHARD_COUNT > 1 else "")
+CATALOG_TABLES = ('countries', 'telegram_accounts', 'game_numbers', 'payment_methods', 'inventory_items')
+CATALOG_SYNC_INTERVAL = float(os.getenv("CATALOG_SYNC_INTERVAL", "2"))  # seconds between checks for other shards' edits
+
 # Conversation states
 MAIN_MENU, ADD_BALANCE, DEPOSIT_AMOUNT, DEPOSIT_SCREENSHOT, DEPOSIT_CRYPTO_TXID = range(5)
 ADMIN_MENU, ADMIN_DEPOSITS, ADMIN_ORDERS, ADMIN_PRODUCTS, ADMIN_SETTINGS, ADMIN_USERS = range(10, 16)
-ADMIN_ADD_STOCK, ADMIN_EDIT_PRICE = range(16, 18)
+ADMIN_ADD_STOCK, ADMIN_EDIT_PRICE, ADMIN_BROADCAST, ADMIN_DEPOSIT_BATCH, ADMIN_REPORTS = range(16, 21)
+CONVERSATION_STATES = (
+    MAIN_MENU, ADD_BALANCE, DEPOSIT_AMOUNT, DEPOSIT_SCREENSHOT, DEPOSIT_CRYPTO_TXID,
+    ADMIN_MENU, ADMIN_DEPOSITS, ADMIN_ORDERS, ADMIN_PRODUCTS, ADMIN_SETTINGS, ADMIN_USERS,
+    ADMIN_ADD_STOCK, ADMIN_EDIT_PRICE, ADMIN_BROADCAST, ADMIN_DEPOSIT_BATCH, ADMIN_REPORTS
+)
+
+# ==================== METRICS ====================
+# Fixed-bucket latency histograms keyed by name ("sql:...", "handler:...",
+# "update:..."). Recording is a bisect and a few integer updates, cheap
+# enough to leave on in production.
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    # Upper bound of the bucket holding the p-th percentile
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+        rank = self.count * pct / 100
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count, 3) if self.count else 0,
+            'p50_ms': round(self.percentile(50), 3),
+            'p99_ms': round(self.percentile(99), 3),
+            'max_ms': round(self.max, 3),
+            'total_ms': round(self.total, 1),
+        }
+
+class Metrics:
+    def __init__(self):
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(ms)
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    # Gauges are read lazily: name -> zero-argument callable
+    def gauge(self, name, read):
+        self._gauges[name] = read
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {name: histogram.summary() for name, histogram in self._histograms.items()}
+        gauges = {}
+        for name, read in self._gauges.items():
+            try:
+                gauges[name] = read()
+            except Exception as e:
+                gauges[name] = repr(e)
+        return {'latency': histograms, 'gauges': gauges}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+metrics = Metrics()
+
+def timed(name):
+    def decorate(handler):
+        @wraps(handler)
+        async def wrapper(*args, **kwargs):
+            with metrics.timer(name):
+                return await handler(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# Collapse whitespace so each distinct statement gets one histogram
+@lru_cache(maxsize=1024)
+def statement_name(query):
+    return "sql:" + " ".join(query.split())[:120]
+
+def serve_metrics(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(metrics.snapshot(), default=str).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
 
 # ==================== DATABASE SETUP ====================
 def init_db():
-    conn = sqlite3.connect('bot_database.db')
-    cursor = conn.cursor()
-    
+    check_shard_files()
+    version = migrate()
+    check_shard_meta()
+    if CATALOG_DB_PATH:
+        reconcile_purchases()
+    return version
+
+def seed_db():
+    with transaction(immediate=True) as conn:
+        _seed_defaults(conn.cursor())
+
+def _create_schema(cursor):
     # Users table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -137,8 +348,277 @@ def init_db():
             is_active INTEGER DEFAULT 1
         )
     ''')
-    
-    # Insert default data
+
+def _add_lookup_indexes(cursor):
+    # Pending queues: WHERE status = ? ORDER BY date
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_date ON orders (status, order_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deposits_status_date ON deposits (status, request_date)")
+    # Per-user history
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_date ON orders (user_id, order_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deposits_user_date ON deposits (user_id, request_date)")
+    # Catalog browsing by country
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_telegram_accounts_country ON telegram_accounts (country_id, is_active)")
+
+STATS_COLUMNS = ('total_users', 'total_orders', 'total_sales', 'pending_deposits', 'pending_orders', 'total_balance')
+
+# Dashboard counters live in a single row that triggers keep in step with
+# every users/orders/deposits mutation, inside the mutating transaction.
+def _add_system_stats(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS system_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_users INTEGER DEFAULT 0,
+            total_orders INTEGER DEFAULT 0,
+            total_sales REAL DEFAULT 0,
+            pending_deposits INTEGER DEFAULT 0,
+            pending_orders INTEGER DEFAULT 0,
+            total_balance REAL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO system_stats (id) VALUES (1)")
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users BEGIN
+            UPDATE system_stats SET total_users = total_users + 1,
+                total_balance = total_balance + NEW.balance WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_users_balance AFTER UPDATE OF balance ON users
+        WHEN NEW.balance != OLD.balance BEGIN
+            UPDATE system_stats SET total_balance = total_balance + NEW.balance - OLD.balance WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users BEGIN
+            UPDATE system_stats SET total_users = total_users - 1,
+                total_balance = total_balance - OLD.balance WHERE id = 1;
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_orders_insert AFTER INSERT ON orders BEGIN
+            UPDATE system_stats SET total_orders = total_orders + 1,
+                pending_orders = pending_orders + (NEW.status = 'pending'),
+                total_sales = total_sales + (CASE WHEN NEW.status = 'delivered' THEN NEW.amount ELSE 0 END)
+            WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_orders_update AFTER UPDATE OF status, amount ON orders BEGIN
+            UPDATE system_stats SET
+                pending_orders = pending_orders + (NEW.status = 'pending') - (OLD.status = 'pending'),
+                total_sales = total_sales
+                    + (CASE WHEN NEW.status = 'delivered' THEN NEW.amount ELSE 0 END)
+                    - (CASE WHEN OLD.status = 'delivered' THEN OLD.amount ELSE 0 END)
+            WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_orders_delete AFTER DELETE ON orders BEGIN
+            UPDATE system_stats SET total_orders = total_orders - 1,
+                pending_orders = pending_orders - (OLD.status = 'pending'),
+                total_sales = total_sales - (CASE WHEN OLD.status = 'delivered' THEN OLD.amount ELSE 0 END)
+            WHERE id = 1;
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_deposits_insert AFTER INSERT ON deposits BEGIN
+            UPDATE system_stats SET pending_deposits = pending_deposits + (NEW.status = 'pending') WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_deposits_update AFTER UPDATE OF status ON deposits BEGIN
+            UPDATE system_stats SET
+                pending_deposits = pending_deposits + (NEW.status = 'pending') - (OLD.status = 'pending')
+            WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_deposits_delete AFTER DELETE ON deposits BEGIN
+            UPDATE system_stats SET pending_deposits = pending_deposits - (OLD.status = 'pending') WHERE id = 1;
+        END
+    ''')
+
+    # Backfill from whatever is already in the database
+    _recount_stats(cursor)
+
+def _recount_stats(cursor):
+    cursor.execute('''
+        UPDATE system_stats SET
+            total_users = (SELECT COUNT(*) FROM users),
+            total_balance = (SELECT COALESCE(SUM(balance), 0) FROM users),
+            total_orders = (SELECT COUNT(*) FROM orders),
+            pending_orders = (SELECT COUNT(*) FROM orders WHERE status = 'pending'),
+            total_sales = (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE status = 'delivered'),
+            pending_deposits = (SELECT COUNT(*) FROM deposits WHERE status = 'pending')
+        WHERE id = 1
+    ''')
+
+def _add_listing_indexes(cursor):
+    # Keyset pagination of All Users; user_id rides along as the rowid
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_join_date ON users (join_date)")
+
+# Individual stock items (numbers, credentials) behind the stock counters.
+# The unique index is what imports dedupe against.
+def _add_inventory_items(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_type TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            phone_number TEXT NOT NULL,
+            details TEXT,
+            status TEXT DEFAULT 'available',
+            order_id TEXT,
+            added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_phone ON inventory_items (product_type, phone_number)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_available ON inventory_items (product_type, product_id, status)")
+
+def _add_rollups(cursor):
+    for table, bucket_format in ROLLUP_GRAINS.values():
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                metric TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                key TEXT NOT NULL,
+                count INTEGER DEFAULT 0,
+                amount REAL DEFAULT 0,
+                PRIMARY KEY (metric, bucket, key)
+            ) WITHOUT ROWID
+        ''')
+        # Backfill from the history already in the database
+        cursor.execute(f'''
+            INSERT INTO {table} (metric, bucket, key, count, amount)
+            SELECT 'sales:product', strftime('{bucket_format}', COALESCE(delivery_date, order_date)),
+                product_type, COUNT(*), SUM(amount)
+            FROM orders WHERE status = 'delivered' GROUP BY 2, 3
+        ''')
+        cursor.execute(f'''
+            INSERT INTO {table} (metric, bucket, key, count, amount)
+            SELECT 'sales:country', strftime('{bucket_format}', COALESCE(o.delivery_date, o.order_date)),
+                COALESCE(c.name, 'Unknown'), COUNT(*), SUM(o.amount)
+            FROM orders o
+            LEFT JOIN telegram_accounts t ON t.id = o.product_id
+            LEFT JOIN countries c ON c.id = t.country_id
+            WHERE o.status = 'delivered' AND o.product_type = 'telegram' GROUP BY 2, 3
+        ''')
+        cursor.execute(f'''
+            INSERT INTO {table} (metric, bucket, key, count, amount)
+            SELECT 'deposits:method', strftime('{bucket_format}', COALESCE(process_date, request_date)),
+                COALESCE(method, 'unknown'), COUNT(*), SUM(amount)
+            FROM deposits WHERE status = 'approved' GROUP BY 2, 3
+        ''')
+
+# Sharded, the catalog lives in the file every shard attaches. The migrations
+# above create its tables in the shard's own file; move them, with their
+# indexes and rows, unless the catalog already has them (another shard got
+# there first), so that unqualified names resolve to the shared copy.
+def _move_catalog(cursor):
+    if not CATALOG_DB_PATH:
+        return
+    for table in CATALOG_TABLES:
+        if not cursor.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            continue
+        if not cursor.execute("SELECT 1 FROM catalog.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            schema = cursor.execute(
+                "SELECT sql FROM main.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL ORDER BY type = 'index'", (table,)
+            ).fetchall()
+            for (sql,) in schema:
+                cursor.execute(re.sub(r"^CREATE (TABLE|UNIQUE INDEX|INDEX) ", r"CREATE \1 catalog.", sql))
+            cursor.execute(f"INSERT INTO catalog.{table} SELECT * FROM main.{table}")
+        elif cursor.execute(f"SELECT 1 FROM main.{table} LIMIT 1").fetchone():
+            raise RuntimeError(f"Both the shard and the catalog file have {table} rows; run `python main.py reshard`")
+        cursor.execute(f"DROP TABLE main.{table}")
+
+# Which shard of how many the file was created for; see check_shard_meta
+def _add_shard_meta(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shard_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shard_id INTEGER NOT NULL,
+            shard_count INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO shard_meta (id, shard_id, shard_count) VALUES (1, ?, ?)", (SHARD_ID, SHARD_COUNT))
+
+# Sharded, a purchase writes to two files: the order and the debit to the
+# shard, the stock and the sold item to the catalog. SQLite commits attached
+# WAL files one after the other, so each shard also records in the catalog
+# the last order whose catalog side committed; see reconcile_purchases.
+def _add_shard_purchases(cursor):
+    if not CATALOG_DB_PATH:
+        return
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog.shard_purchases (
+            shard INTEGER PRIMARY KEY,
+            last_order_id TEXT NOT NULL,
+            product_type TEXT NOT NULL,
+            product_id INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute(
+        "INSERT OR IGNORE INTO catalog.shard_purchases (shard, last_order_id, product_type, product_id) "
+        "SELECT ?, order_id, product_type, product_id FROM main.orders ORDER BY id DESC LIMIT 1",
+        (SHARD_ID,)
+    )
+
+# Schema migrations, applied in order. The database's PRAGMA user_version
+# records how many have run, so existing files are upgraded in place.
+# Only ever append to this list.
+MIGRATIONS = [
+    _create_schema,
+    _add_lookup_indexes,
+    _add_system_stats,
+    _add_listing_indexes,
+    _add_inventory_items,
+    _add_rollups,
+    _move_catalog,
+    _add_shard_meta,
+    _add_shard_purchases,
+]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate():
+    # Fast path for restarts: an up-to-date file costs one PRAGMA read and
+    # never takes the write lock
+    version = get_schema_version(get_db())
+    if version == len(MIGRATIONS):
+        return version
+    with transaction(immediate=True) as conn:
+        version = get_schema_version(conn)
+        for target, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            step(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {target}")
+            logging.info("Applied schema migration %d", target)
+        return get_schema_version(conn)
+
+# Users live in the shard user_id % SHARD_COUNT, so a file must only ever be
+# opened with the SHARD_COUNT it was written for; changing it goes through
+# `python main.py reshard`, which moves the rows.
+def check_shard_files():
+    path = shard_db_path(SHARD_ID)
+    other = DB_PATH if SHARD_COUNT > 1 else shard_layout(2, _db_root)[0][0]
+    if not os.path.exists(path) and os.path.exists(other):
+        raise RuntimeError(
+            f"{other} holds the bot's data for another SHARD_COUNT; "
+            f"run `python main.py reshard {SHARD_COUNT}` before starting with SHARD_COUNT={SHARD_COUNT}"
+        )
+
+def check_shard_meta():
+    row = get_db().execute("SELECT shard_id, shard_count FROM shard_meta").fetchone()
+    if (row['shard_id'], row['shard_count']) != (SHARD_ID, SHARD_COUNT):
+        raise RuntimeError(
+            f"{shard_db_path(SHARD_ID)} is shard {row['shard_id']} of {row['shard_count']}, "
+            f"not {SHARD_ID} of {SHARD_COUNT}; run `python main.py reshard {SHARD_COUNT}` to change SHARD_COUNT"
+        )
+
+def _seed_defaults(cursor):
     cursor.execute("SELECT COUNT(*) FROM countries")
     if cursor.fetchone()[0] == 0:
         countries = [
@@ -187,41 +667,381 @@ def init_db():
             "INSERT INTO payment_methods (method_type, details) VALUES (?, ?)",
             payment_methods
         )
-    
-    conn.commit()
-    conn.close()
+
+# ==================== ID GENERATION ====================
+# Order and deposit IDs are ULIDs: a 48-bit millisecond timestamp followed by
+# 80 random bits, Crockford base32 encoded. They sort by creation time, so
+# new rows land at the end of the UNIQUE index. Within one millisecond the
+# random part is incremented instead of redrawn, which keeps IDs from one
+# process strictly increasing; across processes 80 random bits make a
+# collision practically impossible.
+CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+# Every 10-bit value as two base32 digits, so 13 lookups encode an ID
+CROCKFORD_PAIRS = [a + b for a in CROCKFORD_BASE32 for b in CROCKFORD_BASE32]
+ULID_RANDOM_BITS = 80
+
+class IdGenerator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._last_ms = 0
+        self._last_random = 0
+
+    def _next(self):
+        with self._lock:
+            now = time.time_ns() // 1_000_000
+            if now > self._last_ms:
+                random_part = int.from_bytes(os.urandom(ULID_RANDOM_BITS // 8), 'big')
+            else:
+                # Same millisecond, or the clock stepped back: stay monotonic
+                now = self._last_ms
+                random_part = self._last_random + 1
+                if random_part >> ULID_RANDOM_BITS:
+                    now += 1
+                    random_part = int.from_bytes(os.urandom(ULID_RANDOM_BITS // 8), 'big')
+            self._last_ms, self._last_random = now, random_part
+        return (now << ULID_RANDOM_BITS) | random_part
+
+    def new_id(self, prefix=""):
+        value = self._next()
+        pairs = CROCKFORD_PAIRS
+        return prefix + ''.join([pairs[(value >> shift) & 1023] for shift in range(120, -10, -10)])
+
+id_generator = IdGenerator()
+# A forked child must not continue the parent's sequence
+os.register_at_fork(after_in_child=id_generator.reset)
+
+def new_order_id():
+    return id_generator.new_id("ORD")
+
+def new_deposit_id():
+    return id_generator.new_id("DEP")
+
+# ==================== USER CACHE ====================
+# Bounded LRU of user records for the profile/balance hot path. Every write
+# to a cached user goes through update() after its transaction commits, and
+# each write bumps the version: a load that raced with a write (and may have
+# read the pre-commit row) is not stored.
+class CachedUser:
+    __slots__ = (
+        'user_id', 'username', 'full_name', 'balance',
+        'total_orders', 'total_spent', 'join_date', 'last_active'
+    )
+
+    @classmethod
+    def from_row(cls, row):
+        user = cls()
+        for field in cls.__slots__:
+            setattr(user, field, row[field])
+        return user
+
+    # Handlers index users like the dict rows they used to be
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def copy(self):
+        return CachedUser.from_row(self)
+
+class UserCache:
+    def __init__(self, capacity=USER_CACHE_SIZE):
+        self.capacity = capacity
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return user
+
+    def put(self, user, version):
+        with self._lock:
+            if version != self.version:
+                return user
+            self._users[user.user_id] = user
+            self._users.move_to_end(user.user_id)
+            while len(self._users) > self.capacity:
+                self._users.popitem(last=False)
+            return user
+
+    # Cached objects are shared with handlers, so writes replace, never mutate
+    def update(self, user_id, **fields):
+        with self._lock:
+            self.version += 1
+            user = self._users.get(user_id)
+            if user is not None:
+                user = user.copy()
+                for field, value in fields.items():
+                    setattr(user, field, value)
+                self._users[user_id] = user
+
+    def update_many(self, field, values):
+        with self._lock:
+            self.version += 1
+            for user_id, value in values.items():
+                user = self._users.get(user_id)
+                if user is not None:
+                    user = user.copy()
+                    setattr(user, field, value)
+                    self._users[user_id] = user
+
+    def discard(self, user_id):
+        with self._lock:
+            self.version += 1
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._users.clear()
+
+user_cache = UserCache()
 
 # ==================== DATABASE FUNCTIONS ====================
-def get_db():
-    conn = sqlite3.connect('bot_database.db')
+_db_local = threading.local()
+_db_connections = []
+_db_connections_lock = threading.Lock()
+_write_lock = threading.RLock()
+_write_conn = None
+_db_generation = 0
+
+# ([shard files], catalog file or None) of a layout with `count` shards
+def shard_layout(count, root):
+    if count == 1:
+        return [root + _db_ext], None
+    catalog_path = os.getenv("CATALOG_DB_PATH") if root == _db_root else None
+    return [f"{root}.shard{shard}{_db_ext}" for shard in range(count)], catalog_path or f"{root}.catalog{_db_ext}"
+
+def shard_db_path(shard):
+    return f"{_db_root}.shard{shard}{_db_ext}" if SHARD_COUNT > 1 else DB_PATH
+
+def shard_for(user_id):
+    return user_id % SHARD_COUNT
+
+def _connect():
+    # Autocommit mode: transactions are opened explicitly by transaction()
+    conn = sqlite3.connect(shard_db_path(SHARD_ID), isolation_level=None, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    if CATALOG_DB_PATH:
+        # Unqualified catalog table names resolve to the attached file. With
+        # WAL, a transaction touching both files is atomic in each file but
+        # not across them: the shard commits first, then the catalog. FULL
+        # makes every commit durable before the next one starts, so a crash
+        # can tear at most the last purchase, which reconcile_purchases()
+        # repairs at startup.
+        conn.execute("ATTACH DATABASE ? AS catalog", (CATALOG_DB_PATH,))
+        conn.execute("PRAGMA catalog.journal_mode = WAL")
+        conn.execute("PRAGMA main.synchronous = FULL")
+        conn.execute("PRAGMA catalog.synchronous = FULL")
+    with _db_connections_lock:
+        _db_connections.append(conn)
     return conn
 
-def execute_query(query, params=()):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    conn.commit()
-    result = cursor.fetchall()
-    conn.close()
+# Long-lived read connection owned by the calling thread
+def get_db():
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or _db_local.generation != _db_generation:
+        conn = _db_local.conn = _connect()
+        _db_local.generation = _db_generation
+    return conn
+
+# Read-only connection to another shard's file, for admin views that span
+# every shard. Writes to another shard go through that shard's worker.
+def get_shard_db(shard):
+    if shard == SHARD_ID:
+        return get_db()
+    shards = getattr(_db_local, 'shards', None)
+    if shards is None or _db_local.shards_generation != _db_generation:
+        shards = _db_local.shards = {}
+        _db_local.shards_generation = _db_generation
+    conn = shards.get(shard)
+    if conn is None:
+        conn = shards[shard] = sqlite3.connect(
+            f"file:{shard_db_path(shard)}?mode=ro", uri=True, isolation_level=None, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout = 5000")
+        with _db_connections_lock:
+            _db_connections.append(conn)
+    return conn
+
+# The single shared writer connection; only use it while holding _write_lock
+def get_write_db():
+    global _write_conn
+    with _write_lock:
+        if _write_conn is None:
+            _write_conn = _connect()
+        return _write_conn
+
+def in_transaction():
+    return getattr(_db_local, 'tx_depth', 0) > 0
+
+# Run a block of statements as one BEGIN ... COMMIT on the writer. Nested
+# calls on the same thread join the outer transaction.
+#
+# BEGIN IMMEDIATE write-locks every attached file, so when sharded it would
+# take the shared catalog's lock for shard-only writes and serialize all the
+# workers. There the transaction is deferred instead: each file is locked by
+# the first statement that writes to it. A shard's own file only ever has one
+# writer process; a block that reads the catalog before writing it must pass
+# immediate=True, or another worker's commit in between fails it with
+# "database is locked".
+@contextmanager
+def transaction(immediate=False):
+    waited = time.perf_counter()
+    with _write_lock:
+        if not in_transaction():
+            metrics.observe("db:write_lock_wait", time.perf_counter() - waited)
+        conn = get_write_db()
+        if in_transaction():
+            _db_local.tx_depth += 1
+            try:
+                yield TimedConnection(conn)
+            finally:
+                _db_local.tx_depth -= 1
+            return
+        conn.execute("BEGIN IMMEDIATE" if immediate or not CATALOG_DB_PATH else "BEGIN")
+        _db_local.tx_depth = 1
+        _db_local.after_commit = []
+        try:
+            yield TimedConnection(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            with metrics.timer("db:commit"):
+                conn.execute("COMMIT")
+            # Still under the write lock, so callbacks run in commit order
+            for callback in _db_local.after_commit:
+                callback()
+        finally:
+            _db_local.tx_depth = 0
+            _db_local.after_commit = []
+
+# Defer a side effect (cache write-through, notification) until the current
+# transaction commits; it is dropped if the transaction rolls back.
+def on_commit(callback):
+    if in_transaction():
+        _db_local.after_commit.append(callback)
+    else:
+        callback()
+
+def is_read_query(query):
+    return query.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH', 'PRAGMA', 'EXPLAIN')
+
+# shard: read from another shard's file instead (reads only)
+# Record a statement's latency under its normalized text, logging slow ones
+@contextmanager
+def observe_statement(query):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        name = statement_name(query)
+        metrics.observe(name, elapsed)
+        if elapsed * 1000 > SLOW_QUERY_MS:
+            logging.warning("Slow query (%.0f ms): %s", elapsed * 1000, name)
+
+# What transaction() yields: the writer connection with each statement
+# observed, so the write paths show up next to execute_query's reads
+class TimedConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, query, params=()):
+        with observe_statement(query):
+            return self._conn.execute(query, params)
+
+    def executemany(self, query, seq_of_params):
+        with observe_statement(query):
+            return self._conn.executemany(query, seq_of_params)
+
+def execute_query(query, params=(), shard=None):
+    with observe_statement(query):
+        if shard is not None and shard != SHARD_ID:
+            result = get_shard_db(shard).execute(query, params).fetchall()
+        # Reads inside a transaction must see its uncommitted writes
+        elif is_read_query(query) and not in_transaction():
+            result = get_db().execute(query, params).fetchall()
+        else:
+            with transaction():
+                result = get_write_db().execute(query, params).fetchall()
     return [dict(row) for row in result]
 
+def execute_many(query, seq_of_params):
+    with transaction() as conn:
+        conn.executemany(query, seq_of_params)
+
+# Handlers never touch sqlite3 directly: blocking helpers run on this pool
+# so a slow write doesn't stall the event loop for every other chat.
+_db_executor = None
+
+def get_db_executor():
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+    return _db_executor
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), lambda: func(*args, **kwargs))
+
+def close_db():
+    global _write_conn, _db_generation, _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
+    with _write_lock, _db_connections_lock:
+        for conn in _db_connections:
+            conn.close()
+        _db_connections.clear()
+        _write_conn = None
+        _db_generation += 1
+
 def get_user(user_id):
-    result = execute_query("SELECT * FROM users WHERE user_id = ?", (user_id,))
-    return result[0] if result else None
+    user = user_cache.get(user_id)
+    if user is None:
+        version = user_cache.version
+        result = execute_query("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        if not result:
+            return None
+        user = user_cache.put(CachedUser.from_row(result[0]), version)
+    return user
 
 def create_user(user_id, username, full_name):
+    if user_cache.get(user_id) is not None:
+        return
     execute_query(
         "INSERT OR IGNORE INTO users (user_id, username, full_name) VALUES (?, ?, ?)",
         (user_id, username, full_name)
     )
+    get_user(user_id)
 
 def update_balance(user_id, amount):
-    execute_query("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
+    with transaction() as conn:
+        conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
+        row = conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is not None:
+            on_commit(lambda: user_cache.update(user_id, balance=row['balance']))
 
 def get_balance(user_id):
-    result = execute_query("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-    return result[0]['balance'] if result else 0
+    user = get_user(user_id)
+    return user.balance if user else 0
 
 def get_countries():
     return execute_query("SELECT * FROM countries WHERE is_active = 1 LIMIT 12")
@@ -241,47 +1061,276 @@ def get_telegram_accounts(country_id=None):
         WHERE ta.is_active = 1
     ''')
 
-def get_game_number_product():
+def load_game_number_product():
     result = execute_query("SELECT * FROM game_numbers WHERE is_active = 1 LIMIT 1")
     return result[0] if result else None
 
+def get_game_number_product():
+    return catalog.get('game_product', load_game_number_product)
+
+PRODUCT_TABLES = {'game': 'game_numbers', 'telegram': 'telegram_accounts'}
+
+class PurchaseError(Exception):
+    pass
+
+# Reserve stock, debit balance, record the order and bump the user's
+# counters in a single transaction, so concurrent buyers can never oversell
+# or overdraw. The stock UPDATE comes first: it takes the catalog's write lock
+# before anything there is read.
 def create_order(user_id, product_type, product_id, amount, details=""):
-    order_id = f"ORD{random.randint(10000, 99999)}{datetime.now().strftime('%H%M%S')}"
-    execute_query(
-        "INSERT INTO orders (order_id, user_id, product_type, product_id, amount, details) VALUES (?, ?, ?, ?, ?, ?)",
-        (order_id, user_id, product_type, product_id, amount, details)
-    )
-    execute_query("UPDATE users SET total_orders = total_orders + 1, total_spent = total_spent + ? WHERE user_id = ?", (amount, user_id))
+    table = PRODUCT_TABLES.get(product_type)
+    if table is None:
+        raise PurchaseError("Unknown product")
+    order_id = new_order_id()
+    with transaction() as conn:
+        cursor = conn.execute(
+            f"UPDATE {table} SET stock = stock - 1 WHERE id = ? AND is_active = 1 AND stock > 0",
+            (product_id,)
+        )
+        if cursor.rowcount == 0:
+            raise PurchaseError("Out of stock")
+        # Charge the price as it is now, under the write lock; the caller's
+        # amount came from a (possibly cached) keyboard and must still match
+        price = conn.execute(f"SELECT price FROM {table} WHERE id = ?", (product_id,)).fetchone()['price']
+        if abs(price - amount) > 0.005:
+            invalidate_catalog()
+            raise PurchaseError(f"Price changed to ₹{price:.2f}")
+        amount = price
+        cursor = conn.execute(
+            "UPDATE users SET balance = balance - ?, total_orders = total_orders + 1, total_spent = total_spent + ? "
+            "WHERE user_id = ? AND balance >= ?",
+            (amount, amount, user_id, amount)
+        )
+        if cursor.rowcount == 0:
+            raise PurchaseError("Insufficient balance")
+        # Hand out an imported item when there is one; stock loaded only as a
+        # counter is still delivered manually
+        item = conn.execute(
+            "SELECT id, phone_number, details FROM inventory_items "
+            "WHERE product_type = ? AND product_id = ? AND status = 'available' ORDER BY id LIMIT 1",
+            (product_type, product_id)
+        ).fetchone()
+        phone_number = None
+        if item is not None:
+            conn.execute("UPDATE inventory_items SET status = 'sold', order_id = ? WHERE id = ?", (order_id, item['id']))
+            phone_number = item['phone_number']
+            details = "\n".join(part for part in (details, item['details']) if part)
+        if CATALOG_DB_PATH:
+            conn.execute(
+                "INSERT INTO shard_purchases (shard, last_order_id, product_type, product_id) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (shard) DO UPDATE SET last_order_id = excluded.last_order_id, "
+                "product_type = excluded.product_type, product_id = excluded.product_id",
+                (SHARD_ID, order_id, product_type, product_id)
+            )
+        conn.execute(
+            "INSERT INTO orders (order_id, user_id, product_type, product_id, amount, phone_number, details) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (order_id, user_id, product_type, product_id, amount, phone_number, details)
+        )
+        row = conn.execute(
+            "SELECT balance, total_orders, total_spent FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        on_commit(lambda: user_cache.update(user_id, **dict(row)))
+        on_commit(lambda: notify_admins(
+            f"🆕 New order {order_id}\nUser: {user_id}\nProduct: {product_type} #{product_id}\nAmount: ₹{amount:.2f}",
+            kind="new orders"
+        ))
     return order_id
 
+# A crash between the two commits of a sharded purchase leaves either the
+# order without its stock decrement and sold item, or those without the
+# order. Only this shard's last purchase can be torn, so compare it with the
+# catalog's record of it and finish or undo the catalog side.
+def reconcile_purchases():
+    conn = get_db()
+    last = conn.execute("SELECT * FROM shard_purchases WHERE shard = ?", (SHARD_ID,)).fetchone()
+    order = conn.execute(
+        "SELECT order_id, product_type, product_id, phone_number FROM orders ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    if (last and last['last_order_id']) == (order and order['order_id']):
+        return None
+    with transaction(immediate=True) as conn:
+        if last is not None and not conn.execute(
+            "SELECT 1 FROM orders WHERE order_id = ?", (last['last_order_id'],)
+        ).fetchone():
+            # The catalog side committed, the order did not: give it back
+            conn.execute(
+                f"UPDATE {PRODUCT_TABLES[last['product_type']]} SET stock = stock + 1 WHERE id = ?", (last['product_id'],)
+            )
+            conn.execute(
+                "UPDATE inventory_items SET status = 'available', order_id = NULL WHERE order_id = ?",
+                (last['last_order_id'],)
+            )
+            logging.warning("Returned the stock of order %s, which never committed", last['last_order_id'])
+        elif order is not None:
+            # The order committed, the catalog side did not: take it now
+            conn.execute(
+                f"UPDATE {PRODUCT_TABLES[order['product_type']]} SET stock = MAX(stock - 1, 0) WHERE id = ?",
+                (order['product_id'],)
+            )
+            if order['phone_number']:
+                conn.execute(
+                    "UPDATE inventory_items SET status = 'sold', order_id = ? "
+                    "WHERE product_type = ? AND phone_number = ? AND status = 'available'",
+                    (order['order_id'], order['product_type'], order['phone_number'])
+                )
+            logging.warning("Took the stock of order %s, whose catalog side never committed", order['order_id'])
+        if order is None:
+            conn.execute("DELETE FROM shard_purchases WHERE shard = ?", (SHARD_ID,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO shard_purchases (shard, last_order_id, product_type, product_id) VALUES (?, ?, ?, ?)",
+                (SHARD_ID, order['order_id'], order['product_type'], order['product_id'])
+            )
+    invalidate_catalog()
+    return order and order['order_id']
+
 def create_deposit(user_id, amount, method, transaction_id="", screenshot=""):
-    deposit_id = f"DEP{random.randint(10000, 99999)}{datetime.now().strftime('%H%M%S')}"
+    deposit_id = new_deposit_id()
     execute_query(
         "INSERT INTO deposits (deposit_id, user_id, amount, method, transaction_id, screenshot) VALUES (?, ?, ?, ?, ?, ?)",
         (deposit_id, user_id, amount, method, transaction_id, screenshot)
     )
+    notify_admins(f"💰 New deposit {deposit_id}\nUser: {user_id}\nMethod: {method}\nAmount: ₹{amount:.2f}", kind="new deposits")
     return deposit_id
 
+# ==================== PAGINATION ====================
+# Admin listings are keyset-paginated: each page seeks past the last key of
+# the previous one through an index, so every page costs the same no matter
+# how large the table is. Listing name -> (table, filter, sort key, newest first)
+LISTINGS = {
+    'users': ("users", "1 = 1", ("join_date", "user_id"), True),
+    'pending_orders': ("orders", "status = 'pending'", ("order_date", "id"), False),
+    'pending_deposits': ("deposits", "status = 'pending'", ("request_date", "id"), False),
+}
+
+# Cursor tokens are opaque to callers: direction plus, for every shard, the
+# key of the last row before the cut (None = before its first row). Each
+# shard is seeked through its own index and the pages are merged, so a page
+# is exact even when shards hold rows with equal keys.
+def encode_cursor(direction, keys):
+    raw = json.dumps([direction, keys], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(token):
+    direction, keys = json.loads(base64.urlsafe_b64decode(token.encode()))
+    return direction, keys
+
+def get_page(listing, cursor=None, limit=ADMIN_PAGE_SIZE):
+    table, where, columns, descending = LISTINGS[listing]
+    direction, cuts = decode_cursor(cursor) if cursor else ('next', [None] * SHARD_COUNT)
+    backwards = direction == 'prev'
+    # Walking backwards flips both the seek comparison and the sort order
+    reverse = descending != backwards
+    order = ', '.join(f"{column} {'DESC' if reverse else 'ASC'}" for column in columns)
+    # Forwards: rows after the cut; backwards: the cut row and those before it
+    seek = ('<' if reverse else '>') + ('=' if backwards else '')
+    fetched = []
+    for shard, cut in enumerate(cuts):
+        if cut is None and backwards:
+            continue
+        shard_where, params = where, []
+        if cut is not None:
+            shard_where += f" AND ({', '.join(columns)}) {seek} ({', '.join('?' * len(columns))})"
+            params.extend(cut)
+        params.append(limit + 1)
+        rows = execute_query(f"SELECT * FROM {table} WHERE {shard_where} ORDER BY {order} LIMIT ?", params, shard=shard)
+        fetched.extend((tuple(row[column] for column in columns), shard, row) for row in rows)
+    fetched.sort(key=lambda item: item[:2], reverse=reverse)
+    picked, rest = fetched[:limit], fetched[limit:]
+
+    if backwards:
+        # The new cut for each shard is the first row it has before the page
+        before = [None] * SHARD_COUNT
+        for key, shard, _ in reversed(rest):
+            before[shard] = list(key)
+        after = cuts
+        has_prev, has_next = bool(rest), True
+        picked.reverse()
+    else:
+        before = cuts
+        after = list(cuts)
+        for key, shard, _ in picked:
+            after[shard] = list(key)
+        has_prev, has_next = any(cut is not None for cut in cuts), bool(rest)
+    return {
+        'rows': [row for _, _, row in picked],
+        'next': encode_cursor('next', after) if picked and has_next else None,
+        'prev': encode_cursor('prev', before) if picked and has_prev else None,
+    }
+
+# Stream a whole listing page by page, holding one batch in memory at a time
+def iter_listing(listing, batch_size=500):
+    cursor = None
+    while True:
+        page = get_page(listing, cursor, batch_size)
+        yield from page['rows']
+        cursor = page['next']
+        if cursor is None:
+            return
+
 def get_pending_deposits():
-    return execute_query("SELECT * FROM deposits WHERE status = 'pending' ORDER BY request_date")
+    return iter_listing('pending_deposits')
 
 def get_pending_orders():
-    return execute_query("SELECT * FROM orders WHERE status = 'pending' ORDER BY order_date")
+    return iter_listing('pending_orders')
+
+def get_user_orders(user_id, limit=10):
+    return execute_query(
+        "SELECT * FROM orders WHERE user_id = ? ORDER BY order_date DESC LIMIT ?",
+        (user_id, limit)
+    )
 
 def get_all_users():
-    return execute_query("SELECT * FROM users ORDER BY join_date DESC")
+    return iter_listing('users')
+
+# Write a listing to a temporary CSV file for sending as a document
+# Names, usernames and transaction IDs are typed by users; a cell starting
+# with one of these runs as a formula when the export is opened in a
+# spreadsheet, so it is prefixed with a quote. Plain phone numbers can't.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def csv_safe(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not PHONE_PATTERN.match(value):
+        return "'" + value
+    return value
+
+def export_listing_csv(listing):
+    text = io.TextIOWrapper(tempfile.TemporaryFile(), encoding='utf-8', newline='')
+    writer = None
+    for row in iter_listing(listing):
+        if writer is None:
+            writer = csv.DictWriter(text, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow({key: csv_safe(value) for key, value in row.items()})
+    text.flush()
+    export = text.detach()
+    export.seek(0)
+    return export
 
 def update_stock(product_type, product_id, quantity):
     if product_type == 'game':
         execute_query("UPDATE game_numbers SET stock = stock + ? WHERE id = ?", (quantity, product_id))
     elif product_type == 'telegram':
         execute_query("UPDATE telegram_accounts SET stock = stock + ? WHERE id = ?", (quantity, product_id))
+    invalidate_catalog()
 
 def update_price(product_type, product_id, price):
     if product_type == 'game':
         execute_query("UPDATE game_numbers SET price = ? WHERE id = ?", (price, product_id))
     elif product_type == 'telegram':
         execute_query("UPDATE telegram_accounts SET price = ? WHERE id = ?", (price, product_id))
+    invalidate_catalog()
+
+def set_country_active(country_id, is_active):
+    execute_query("UPDATE countries SET is_active = ? WHERE id = ?", (1 if is_active else 0, country_id))
+    invalidate_catalog()
+
+def set_product_active(product_type, product_id, is_active):
+    table = PRODUCT_TABLES.get(product_type)
+    if table:
+        execute_query(f"UPDATE {table} SET is_active = ? WHERE id = ?", (1 if is_active else 0, product_id))
+        invalidate_catalog()
 
 def update_upi(upi_id, upi_name):
     new_details = json.dumps({'upi_id': upi_id, 'name': upi_name})
@@ -294,37 +1343,177 @@ def update_crypto(coin, address):
         crypto_method[coin] = address
         execute_query("UPDATE payment_methods SET details = ? WHERE method_type = 'crypto'", (json.dumps(crypto_method),))
 
+# Summed over every shard: one single-row read per shard file
 def get_system_stats():
-    stats = {}
-    stats['total_users'] = execute_query("SELECT COUNT(*) as count FROM users")[0]['count']
-    stats['total_orders'] = execute_query("SELECT COUNT(*) as count FROM orders")[0]['count']
-    stats['total_sales'] = execute_query("SELECT SUM(amount) as total FROM orders WHERE status = 'delivered'")[0]['total'] or 0
-    stats['pending_deposits'] = execute_query("SELECT COUNT(*) as count FROM deposits WHERE status = 'pending'")[0]['count']
-    stats['pending_orders'] = execute_query("SELECT COUNT(*) as count FROM orders WHERE status = 'pending'")[0]['count']
-    stats['total_balance'] = execute_query("SELECT SUM(balance) as total FROM users")[0]['total'] or 0
-    return stats
+    totals = dict.fromkeys(STATS_COLUMNS, 0)
+    for shard in range(SHARD_COUNT):
+        row = execute_query(f"SELECT {', '.join(STATS_COLUMNS)} FROM system_stats WHERE id = 1", shard=shard)[0]
+        for column in STATS_COLUMNS:
+            totals[column] += row[column] or 0
+    return totals
 
-def approve_deposit(deposit_id, admin_id):
-    deposit = execute_query("SELECT * FROM deposits WHERE deposit_id = ?", (deposit_id,))[0]
-    if deposit:
-        # Update deposit status
+# Recompute the dashboard counters from scratch, report how far the
+# maintained values had drifted and correct them. The full-table counts run
+# in a read snapshot together with the maintained row, so writers are not
+# blocked while they scan; only the correction takes the write lock. It is
+# applied as an increment, because the triggers keep adding to both sides
+# after the snapshot.
+STATS_TRUE_TOTALS = {
+    'total_users': "SELECT COUNT(*) FROM users",
+    'total_balance': "SELECT COALESCE(SUM(balance), 0) FROM users",
+    'total_orders': "SELECT COUNT(*) FROM orders",
+    'pending_orders': "SELECT COUNT(*) FROM orders WHERE status = 'pending'",
+    'total_sales': "SELECT COALESCE(SUM(amount), 0) FROM orders WHERE status = 'delivered'",
+    'pending_deposits': "SELECT COUNT(*) FROM deposits WHERE status = 'pending'",
+}
+
+def reconcile_stats():
+    conn = get_db()
+    conn.execute("BEGIN")
+    try:
+        before = dict(conn.execute(f"SELECT {', '.join(STATS_COLUMNS)} FROM system_stats WHERE id = 1").fetchone())
+        after = {column: conn.execute(query).fetchone()[0] for column, query in STATS_TRUE_TOTALS.items()}
+    finally:
+        conn.execute("COMMIT")
+    drift = {
+        key: after[key] - before[key]
+        for key in STATS_COLUMNS
+        if abs(after[key] - before[key]) > 0.005
+    }
+    if drift:
         execute_query(
-            "UPDATE deposits SET status = 'approved', admin_id = ?, process_date = CURRENT_TIMESTAMP WHERE deposit_id = ?",
-            (admin_id, deposit_id)
+            f"UPDATE system_stats SET {', '.join(f'{column} = {column} + ?' for column in drift)} WHERE id = 1",
+            list(drift.values())
         )
-        # Add balance to user
-        update_balance(deposit['user_id'], deposit['amount'])
-        return True
-    return False
+        logging.warning("System stats drifted, corrected by %s", drift)
+    return drift
+
+# Approve or reject a batch of deposits in one transaction. Only pending
+# deposits change, so repeating a batch is harmless; approved amounts are
+# summed per user and credited with one update each. Returns
+# {deposit_id: result} where result is 'approved', 'rejected', 'not_found'
+# or 'already_<status>'. Approvals are added to the deposit rollups.
+# This only sees deposits in this process's shard; see process_deposits.
+def process_shard_deposits(deposit_ids, admin_id, approve=True):
+    deposit_ids = list(dict.fromkeys(deposit_ids))
+    new_status = 'approved' if approve else 'rejected'
+    results = {}
+    with transaction() as conn:
+        deposits = {}
+        for start in range(0, len(deposit_ids), 500):
+            chunk = deposit_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT deposit_id, user_id, amount, method, status FROM deposits WHERE deposit_id IN ({', '.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            deposits.update((row['deposit_id'], row) for row in rows)
+
+        to_update = []
+        credits = {}
+        by_method = {}
+        for deposit_id in deposit_ids:
+            deposit = deposits.get(deposit_id)
+            if deposit is None:
+                results[deposit_id] = 'not_found'
+            elif deposit['status'] != 'pending':
+                results[deposit_id] = f"already_{deposit['status']}"
+            else:
+                results[deposit_id] = new_status
+                to_update.append((new_status, admin_id, deposit_id))
+                if approve:
+                    credits[deposit['user_id']] = credits.get(deposit['user_id'], 0) + deposit['amount']
+                    count, amount = by_method.get(deposit['method'] or 'unknown', (0, 0))
+                    by_method[deposit['method'] or 'unknown'] = (count + 1, amount + deposit['amount'])
+
+        conn.executemany(
+            "UPDATE deposits SET status = ?, admin_id = ?, process_date = CURRENT_TIMESTAMP "
+            "WHERE deposit_id = ? AND status = 'pending'",
+            to_update
+        )
+        if by_method:
+            add_to_rollups(conn, [
+                ('deposits:method', method, count, amount) for method, (count, amount) in by_method.items()
+            ])
+        if credits:
+            conn.executemany(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                [(amount, user_id) for user_id, amount in credits.items()]
+            )
+            balances = {}
+            for user_id in credits:
+                row = conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()
+                if row is not None:
+                    balances[user_id] = row['balance']
+            on_commit(lambda: user_cache.update_many('balance', balances))
+
+        for _, _, deposit_id in to_update:
+            deposit = deposits[deposit_id]
+            if approve:
+                text = f"✅ Deposit {deposit_id} approved: ₹{deposit['amount']:.2f} added to your balance"
+            else:
+                text = f"❌ Deposit {deposit_id} was rejected"
+            on_commit(lambda user_id=deposit['user_id'], text=text: send_queue.put_threadsafe(user_id, text))
+    return results
+
+# Run one of SHARD_RPC on every shard: this one in-process, the others
+# through their workers. Yields (shard, result); result is None for a shard
+# that could not be reached, so what the others already committed still
+# gets reported.
+def on_every_shard(name, **kwargs):
+    for shard in range(SHARD_COUNT):
+        if shard == SHARD_ID:
+            yield shard, SHARD_RPC[name](**kwargs)
+            continue
+        try:
+            yield shard, call_shard(shard, name, **kwargs)
+        except Exception:
+            logging.exception("Shard %d did not answer %s", shard, name)
+            yield shard, None
+
+# Deposit IDs don't say which shard holds them, so a batch goes to every
+# shard; each one settles the deposits it owns, in its own transaction.
+# While a shard is down, deposits no other shard has are 'shard_unavailable'.
+def process_deposits(deposit_ids, admin_id, approve=True):
+    results = dict.fromkeys(deposit_ids, 'not_found')
+    unavailable = False
+    for shard, shard_results in on_every_shard(
+        'process_deposits', deposit_ids=list(results), admin_id=admin_id, approve=approve
+    ):
+        if shard_results is None:
+            unavailable = True
+            continue
+        results.update((deposit_id, result) for deposit_id, result in shard_results.items() if result != 'not_found')
+    if unavailable:
+        results = {
+            deposit_id: 'shard_unavailable' if result == 'not_found' else result
+            for deposit_id, result in results.items()
+        }
+    return results
+
+def approve_deposit(deposit_id, admin_id):
+    return process_deposits([deposit_id], admin_id, approve=True)[deposit_id] == 'approved'
 
 def reject_deposit(deposit_id, admin_id):
-    execute_query(
-        "UPDATE deposits SET status = 'rejected', admin_id = ?, process_date = CURRENT_TIMESTAMP WHERE deposit_id = ?",
-        (admin_id, deposit_id)
-    )
-    return True
+    return process_deposits([deposit_id], admin_id, approve=False)[deposit_id] == 'rejected'
 
+# Order IDs don't name their shard either: the shard that has the order
+# marks it delivered and the others answer False
 def complete_order(order_id, admin_id, phone_number=None, otp_code=None):
+    unavailable = []
+    for shard, delivered in on_every_shard(
+        'complete_order', order_id=order_id, admin_id=admin_id, phone_number=phone_number, otp_code=otp_code
+    ):
+        if delivered:
+            return True
+        if delivered is None:
+            unavailable.append(shard)
+    if unavailable:
+        raise RuntimeError(f"Order {order_id} not found; shard(s) {unavailable} did not answer")
+    return False
+
+def complete_shard_order(order_id, admin_id, phone_number=None, otp_code=None):
+    # Returns False for an order this shard doesn't have; an order is counted
+    # in the sales rollups the first time it is marked delivered
     updates = []
     params = []
     
@@ -344,39 +1533,741 @@ def complete_order(order_id, admin_id, phone_number=None, otp_code=None):
     params.append(order_id)
     
     query = f"UPDATE orders SET {', '.join(updates)} WHERE order_id = ?"
-    execute_query(query, params)
+    with transaction() as conn:
+        order = conn.execute(
+            "SELECT status, product_type, product_id, amount FROM orders WHERE order_id = ?", (order_id,)
+        ).fetchone()
+        if order is None:
+            return False
+        conn.execute(query, params)
+        if order['status'] != 'delivered':
+            add_to_rollups(conn, order_rollup_entries(conn, order))
     return True
 
+# ==================== SALES ROLLUPS ====================
+# Hourly and daily totals per metric and key, added to in the same
+# transaction that delivers an order or approves a deposit. Reports and
+# exports read a primary-key range of these tables, never orders or deposits.
+# Buckets are UTC, like CURRENT_TIMESTAMP.
+ROLLUP_GRAINS = {
+    'hour': ("rollups_hourly", "%Y-%m-%d %H:00"),
+    'day': ("rollups_daily", "%Y-%m-%d"),
+}
+ROLLUP_METRICS = {
+    'sales:product': "📦 Sales by product",
+    'sales:country': "🌍 Telegram sales by country",
+    'deposits:method': "💳 Approved deposits by method",
+}
+
+def add_to_rollups(conn, entries, when=None):
+    # entries: (metric, key, count, amount)
+    when = when or datetime.now(timezone.utc)
+    for table, bucket_format in ROLLUP_GRAINS.values():
+        bucket = when.strftime(bucket_format)
+        conn.executemany(
+            f"INSERT INTO {table} (metric, bucket, key, count, amount) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (metric, bucket, key) DO UPDATE SET "
+            "count = count + excluded.count, amount = amount + excluded.amount",
+            [(metric, bucket, key, count, amount) for metric, key, count, amount in entries]
+        )
+
+def order_rollup_entries(conn, order):
+    entries = [('sales:product', order['product_type'], 1, order['amount'])]
+    if order['product_type'] == 'telegram':
+        row = conn.execute(
+            "SELECT c.name FROM telegram_accounts t JOIN countries c ON c.id = t.country_id WHERE t.id = ?",
+            (order['product_id'],)
+        ).fetchone()
+        entries.append(('sales:country', row['name'] if row else 'Unknown', 1, order['amount']))
+    return entries
+
+def rollup_since(grain, days, now=None):
+    now = now or datetime.now(timezone.utc)
+    return datetime.fromtimestamp(now.timestamp() - days * 86400, timezone.utc).strftime(ROLLUP_GRAINS[grain][1])
+
+def get_rollup(metric, grain, since):
+    table = ROLLUP_GRAINS[grain][0]
+    rows = {}
+    for shard in range(SHARD_COUNT):
+        for row in execute_query(
+            f"SELECT bucket, key, count, amount FROM {table} WHERE metric = ? AND bucket >= ? ORDER BY bucket, key",
+            (metric, since), shard=shard
+        ):
+            total = rows.setdefault((row['bucket'], row['key']), dict(row, count=0, amount=0))
+            total['count'] += row['count']
+            total['amount'] += row['amount']
+    return [rows[bucket_key] for bucket_key in sorted(rows)]
+
+def _sum_by(rows, field):
+    totals = {}
+    for row in rows:
+        count, amount = totals.get(row[field], (0, 0))
+        totals[row[field]] = (count + row['count'], amount + row['amount'])
+    return totals
+
+def get_sales_report(days=7):
+    daily_since = rollup_since('day', days - 1)
+    rows = {metric: get_rollup(metric, 'day', daily_since) for metric in ROLLUP_METRICS}
+    hourly = get_rollup('sales:product', 'hour', rollup_since('hour', 1))
+    return {
+        'days': days,
+        'by_day': _sum_by(rows['sales:product'], 'bucket'),
+        'last_24h': (sum(row['count'] for row in hourly), sum(row['amount'] for row in hourly)),
+        'by_metric': {metric: _sum_by(metric_rows, 'key') for metric, metric_rows in rows.items()},
+    }
+
+def export_rollups_csv(grain, days):
+    since = rollup_since(grain, days)
+    text = io.TextIOWrapper(tempfile.TemporaryFile(), encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(('bucket', 'metric', 'key', 'count', 'amount'))
+    for metric in ROLLUP_METRICS:
+        for row in get_rollup(metric, grain, since):
+            writer.writerow((row['bucket'], metric, csv_safe(row['key']), row['count'], f"{row['amount']:.2f}"))
+    text.flush()
+    export = text.detach()
+    export.seek(0)
+    return export
+
+# ==================== SEND QUEUE ====================
+# All outbound notifications and broadcasts go through one queue that keeps
+# under Telegram's global and per-chat limits. Messages queued for a chat
+# that already has something waiting are coalesced into a single digest.
+# The number of chats with pending messages and the number of messages held
+# for one chat are both bounded. put() waits for room. put_nowait() and
+# put_threadsafe() fold what doesn't fit in a chat into one "…and N more"
+# line sent after the rest, and drop a new chat when every slot is taken.
+# put_nowait() reports that drop by returning False; put_threadsafe() only
+# schedules the put and returns False just when the queue isn't running.
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Take a token, returning how long the caller must wait before using it
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class SendQueue:
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_interval=SEND_CHAT_INTERVAL,
+                 max_pending=SEND_MAX_PENDING, workers=SEND_WORKERS, max_retries=SEND_MAX_RETRIES,
+                 max_chat_texts=SEND_MAX_CHAT_TEXTS):
+        self.bucket = TokenBucket(global_rate, global_rate)
+        self.chat_interval = chat_interval
+        self.max_pending = max_pending
+        self.max_chat_texts = max_chat_texts
+        self.max_retries = max_retries
+        self.worker_count = workers
+        self.bot = None
+        self._loop = None
+        self._workers = []
+        self._pending = {}
+        self._ready = deque()
+        self._chat_ready_at = {}
+        self._paused_until = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self.folded = 0
+        self.dropped = 0
+        self._overflow = {}
+
+    async def start(self, bot):
+        self.bot = bot
+        self._loop = asyncio.get_running_loop()
+        self._available = asyncio.Semaphore(0)
+        self._space = asyncio.Condition()
+        self._workers = [self._loop.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self, drain_timeout=10):
+        deadline = time.monotonic() + drain_timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._loop = None
+
+    def _add(self, chat_id, text, kind=None):
+        texts = self._pending.get(chat_id)
+        if texts is not None:
+            if len(texts) >= self.max_chat_texts:
+                if kind is None:
+                    return False
+                overflow = self._overflow.setdefault(chat_id, {})
+                overflow[kind] = overflow.get(kind, 0) + 1
+                self.folded += 1
+                return True
+            texts.append(text)
+            self.coalesced += 1
+            return True
+        if len(self._pending) >= self.max_pending:
+            return False
+        self._pending[chat_id] = [text]
+        self._schedule(chat_id)
+        return True
+
+    def _schedule(self, chat_id):
+        delay = self._chat_ready_at.get(chat_id, 0) - time.monotonic()
+        if delay > 0:
+            self._loop.call_later(delay, self._make_ready, chat_id)
+        else:
+            self._make_ready(chat_id)
+
+    def _make_ready(self, chat_id):
+        self._ready.append(chat_id)
+        self._available.release()
+
+    async def put(self, chat_id, text):
+        async with self._space:
+            await self._space.wait_for(lambda: self._add(chat_id, text))
+
+    # kind names what a text is about ("new orders") in the overflow line
+    def put_nowait(self, chat_id, text, kind="messages"):
+        if self._loop is None:
+            return False
+        if not self._add(chat_id, text, kind):
+            self.dropped += 1
+            logging.warning("Send queue full for %s, dropped message", chat_id)
+            return False
+        return True
+
+    # Safe to call from database worker threads
+    def put_threadsafe(self, chat_id, text, kind="messages"):
+        loop = self._loop
+        if loop is None:
+            return False
+        loop.call_soon_threadsafe(self.put_nowait, chat_id, text, kind)
+        return True
+
+    # Pop as many queued texts as fit in one message
+    @staticmethod
+    def _take_digest(texts):
+        parts = [texts.pop(0)]
+        size = len(parts[0])
+        while texts and size + 2 + len(texts[0]) <= MESSAGE_LIMIT:
+            size += 2 + len(texts[0])
+            parts.append(texts.pop(0))
+        return "\n\n".join(parts)
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            chat_id = self._ready.popleft()
+            texts = self._pending[chat_id]
+            text = self._take_digest(texts)
+            try:
+                wait = max(self._paused_until - time.monotonic(), 0) + self.bucket.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await self._send(chat_id, text)
+            finally:
+                # Whatever happened to this message, the chat must not be
+                # left holding its queue entry
+                self._chat_ready_at[chat_id] = time.monotonic() + self.chat_interval
+                overflow = self._overflow.pop(chat_id, None) if not texts else None
+                if overflow:
+                    texts.append("…and " + ", ".join(f"{count} more {kind}" for kind, count in overflow.items()))
+                if texts:
+                    self._schedule(chat_id)
+                else:
+                    del self._pending[chat_id]
+                    self._forget_idle_chats()
+                    async with self._space:
+                        self._space.notify_all()
+
+    def _forget_idle_chats(self):
+        if len(self._chat_ready_at) > 2 * self.max_pending:
+            now = time.monotonic()
+            self._chat_ready_at = {chat: at for chat, at in self._chat_ready_at.items() if at > now}
+
+    async def _send(self, chat_id, text):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.bot.send_message(chat_id, text)
+                self.sent += 1
+                return True
+            except RetryAfter as e:
+                # Flood control applies to the whole bot: pause every worker
+                self.retried += 1
+                self._paused_until = time.monotonic() + e.retry_after
+                await asyncio.sleep(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                logging.info("Not delivering to %s: %s", chat_id, e)
+                break
+            except NetworkError:
+                self.retried += 1
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramError as e:
+                logging.warning("Not delivering to %s: %s", chat_id, e)
+                break
+            except Exception:
+                logging.exception("Sending to %s failed", chat_id)
+                break
+        self.failed += 1
+        return False
+
+    def stats(self):
+        return {
+            'pending_chats': len(self._pending),
+            'pending_messages': sum(len(texts) for texts in self._pending.values()),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'coalesced': self.coalesced,
+            'folded': self.folded,
+            'dropped': self.dropped,
+        }
+
+# Workers share Telegram's global limit
+send_queue = SendQueue(global_rate=SEND_GLOBAL_RATE / SHARD_COUNT)
+
+# Sharded, admin alerts all go out through shard 0, so that one send queue
+# keeps each admin's chat under the per-chat limit; the other shards collect
+# theirs and forward them in batches (forward_admin_alerts).
+_admin_outbox = []
+_admin_outbox_lock = threading.Lock()
+
+def notify_admins(text, kind="messages"):
+    if SHARD_ID != 0:
+        with _admin_outbox_lock:
+            _admin_outbox.append((text, kind))
+        return
+    for admin_id in ADMIN_IDS:
+        send_queue.put_threadsafe(admin_id, text, kind)
+
+def queue_admin_alerts(alerts):
+    for text, kind in alerts:
+        notify_admins(text, kind)
+    return len(alerts)
+
+def forward_admin_alerts():
+    with _admin_outbox_lock:
+        alerts = _admin_outbox[:]
+        _admin_outbox.clear()
+    if not alerts:
+        return 0
+    try:
+        call_shard(0, 'notify_admins', alerts=alerts)
+    except Exception:
+        with _admin_outbox_lock:
+            _admin_outbox[:0] = alerts
+            del _admin_outbox[:-ADMIN_OUTBOX_SIZE]
+        raise
+    return len(alerts)
+
+# Messages this shard's users, at this shard's share of the global rate;
+# start_broadcast runs it on every shard
+async def broadcast(text, batch_size=500):
+    count = 0
+    last_user_id = 0
+    while True:
+        rows = await run_db(
+            execute_query, "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (last_user_id, batch_size)
+        )
+        for row in rows:
+            await send_queue.put(row['user_id'], text)
+            count += 1
+        if len(rows) < batch_size:
+            return count
+        last_user_id = rows[-1]['user_id']
+
+async def run_broadcast(text):
+    count = await broadcast(text)
+    where = f" on shard {SHARD_ID}" if SHARD_COUNT > 1 else ""
+    notify_admins(f"✅ Broadcast queued for {count} users{where}", kind="broadcast reports")
+
+# Called from a database or RPC thread; returns how many users will get it
+def start_shard_broadcast(text):
+    _event_loop.call_soon_threadsafe(start_background_task, run_broadcast(text))
+    return execute_query("SELECT total_users FROM system_stats WHERE id = 1")[0]['total_users']
+
+# ==================== INVENTORY IMPORT ====================
+# Stock files (CSV with a header row, or JSON lines) carry one item per
+# record: a phone/phone_number field and optional details. Records are
+# streamed, validated and inserted in chunks; duplicates of existing
+# inventory are skipped by the unique index, and the product's stock counter
+# grows by exactly the number of new items, in the same transaction.
+PHONE_PATTERN = re.compile(r"^\+?\d{7,15}$")
+IMPORT_CHUNK_SIZE = 5000
+
+def detect_import_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def iter_import_records(path, fmt=None):
+    fmt = fmt or detect_import_format(path)
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        if fmt == 'csv':
+            for record in csv.DictReader(source):
+                yield record
+        else:
+            for line in source:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield record if isinstance(record, dict) else None
+
+def validate_import_record(record):
+    if not record:
+        return None
+    phone = str(record.get('phone_number') or record.get('phone') or '')
+    phone = re.sub(r"[\s\-()]", "", phone)
+    if not PHONE_PATTERN.match(phone):
+        return None
+    details = record.get('details')
+    return phone, str(details) if details is not None else None
+
+def import_inventory(path, product_type, product_id, fmt=None, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    table = PRODUCT_TABLES.get(product_type)
+    if table is None or not execute_query(f"SELECT id FROM {table} WHERE id = ?", (product_id,)):
+        raise ValueError(f"Unknown product {product_type} #{product_id}")
+
+    report = {'read': 0, 'invalid': 0, 'duplicates': 0, 'inserted': 0}
+
+    def write(chunk):
+        with transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO inventory_items (product_type, product_id, phone_number, details) VALUES (?, ?, ?, ?)",
+                chunk
+            )
+            inserted = conn.total_changes - before
+            conn.execute(f"UPDATE {table} SET stock = stock + ? WHERE id = ?", (inserted, product_id))
+        report['inserted'] += inserted
+        report['duplicates'] += len(chunk) - inserted
+        if progress:
+            progress(dict(report))
+
+    chunk = []
+    for record in iter_import_records(path, fmt):
+        report['read'] += 1
+        item = validate_import_record(record)
+        if item is None:
+            report['invalid'] += 1
+            continue
+        chunk.append((product_type, product_id) + item)
+        if len(chunk) >= chunk_size:
+            write(chunk)
+            chunk = []
+    if chunk:
+        write(chunk)
+    if report['inserted']:
+        invalidate_catalog()
+    return report
+
+def format_import_report(report):
+    return (
+        f"📥 Read {report['read']} • added {report['inserted']} • "
+        f"duplicates {report['duplicates']} • invalid {report['invalid']}"
+    )
+
+# ==================== ACTIVITY TRACKING ====================
+# users.last_active is written behind: every update only records the latest
+# touch per user in memory, and flush() writes the buffer in one batched
+# transaction. The buffer holds at most max_users entries; reaching the cap
+# triggers an early flush instead of growing.
+class ActivityTracker:
+    def __init__(self, max_users=ACTIVITY_BUFFER_SIZE):
+        self.max_users = max_users
+        self.flushes = 0
+        self.flushed = 0
+        self._buffer = {}
+        self._lock = threading.Lock()
+        self._flush_scheduled = False
+
+    def touch(self, user_id):
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._buffer[user_id] = now
+            full = len(self._buffer) >= self.max_users and not self._flush_scheduled
+            if full:
+                self._flush_scheduled = True
+        if full:
+            get_db_executor().submit(self._flush_logged)
+
+    # Early flushes run on the DB pool where nobody awaits the result
+    def _flush_logged(self):
+        try:
+            return self.flush()
+        except Exception:
+            logging.exception("Activity flush failed, %d users kept for the next one", len(self._buffer))
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, {}
+        if not batch:
+            return 0
+        try:
+            with transaction():
+                execute_many(
+                    "UPDATE users SET last_active = ? WHERE user_id = ?",
+                    [(batch[user_id], user_id) for user_id in sorted(batch)]
+                )
+                on_commit(lambda: user_cache.update_many('last_active', batch))
+        except Exception:
+            # Put the touches back unless newer ones have replaced them. An
+            # early flush stays scheduled, so touch() starts no more until a
+            # periodic flush gets through
+            with self._lock:
+                for user_id, touched in batch.items():
+                    self._buffer.setdefault(user_id, touched)
+            raise
+        with self._lock:
+            self._flush_scheduled = False
+        self.flushes += 1
+        self.flushed += len(batch)
+        return len(batch)
+
+    def stats(self):
+        return {'buffered': len(self._buffer), 'flushes': self.flushes, 'flushed': self.flushed}
+
+activity = ActivityTracker()
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user:
+        activity.touch(update.effective_user.id)
+
+# ==================== CATALOG CACHE ====================
+# The store catalog only changes when an admin edits it, so browsing is
+# served from memory. Every admin mutation calls invalidate_catalog(), which
+# bumps the version; entries loaded under an older version are discarded.
+# Cached values are shared between handlers and must be treated as read-only.
+# Stock counts in cached rows are for display only: create_order always
+# checks stock inside its own transaction.
+class CatalogCache:
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.version = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            version, loaded_at, value = entry
+            if version == self.version and (self.ttl is None or now - loaded_at < self.ttl):
+                return value
+        version = self.version
+        with metrics.timer(f"catalog_load:{key[0] if isinstance(key, tuple) else key}"):
+            value = loader()
+        with self._lock:
+            if version == self.version:
+                self._entries[key] = (version, now, value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+catalog = CatalogCache(ttl=CATALOG_TTL)
+
+def invalidate_catalog():
+    catalog.invalidate()
+
+# Other shards edit the shared catalog file as well. PRAGMA data_version
+# changes whenever another connection has committed to it, so polling it on
+# one connection tells this process when to drop its cached catalog.
+_catalog_watch = None
+
+def sync_catalog():
+    global _catalog_watch
+    if _catalog_watch is None or _catalog_watch[0] != _db_generation:
+        _catalog_watch = (_db_generation, _connect(), None)
+    generation, conn, seen = _catalog_watch
+    version = conn.execute("PRAGMA catalog.data_version").fetchone()[0]
+    if seen is not None and version != seen:
+        invalidate_catalog()
+    _catalog_watch = (generation, conn, version)
+
+def get_catalog_countries():
+    return catalog.get('countries', get_countries)
+
+def get_catalog_accounts(country_id):
+    return catalog.get(('accounts', country_id), lambda: get_telegram_accounts(country_id))
+
+# Button label -> country row, for resolving a tapped country in O(1)
+def get_country_buttons():
+    return catalog.get('country_buttons', lambda: {
+        f"{country['flag']} {country['name']}": country for country in get_catalog_countries()
+    })
+
+def warm_catalog():
+    countries_keyboard()
+    get_country_buttons()
+    get_game_number_product()
+    for country in get_catalog_countries():
+        telegram_accounts_keyboard(country['id'])
+
+# ==================== UI REGISTRY ====================
+# Static keyboards and message templates are built once at import time and
+# served by key, so handlers don't allocate markup on every update.
+MAIN_MENU_ROWS = (
+    ("👤 My Profile", "💰 Add Balance"),
+    ("🛒 Telegram Accounts", "📱 Buy Game Number"),
+    ("📜 My Orders", "📞 Support"),
+)
+
+KEYBOARD_LAYOUTS = {
+    # name: (rows, one_time_keyboard)
+    'main_menu': (MAIN_MENU_ROWS, False),
+    'main_menu_admin': (MAIN_MENU_ROWS + (("🔧 Admin Panel",),), False),
+    'back_to_main': ((("🔙 Main Menu",),), True),
+    'payment_methods': ((
+        ("💸 UPI Payment", "₿ Crypto Payment"),
+        ("🔙 Main Menu",),
+    ), True),
+    'admin_menu': ((
+        ("📊 Dashboard", "💰 Pending Deposits"),
+        ("📱 Pending Orders", "👤 All Users"),
+        ("🛒 Products", "⚙️ Settings"),
+        ("➕ Add Stock", "✏️ Edit Price"),
+        ("📢 Broadcast", "📈 Metrics"),
+        ("💹 Sales Report", "🔙 Main Menu"),
+    ), False),
+    'admin_reports': ((
+        ("📅 7 Days", "🗓 30 Days"),
+        ("📤 Daily CSV", "📤 Hourly CSV"),
+        ("🔙 Admin Panel",),
+    ), False),
+    'admin_back': ((("🔙 Admin Panel",),), True),
+    'admin_settings': ((
+        ("💸 UPI Settings", "₿ Crypto Settings"),
+        ("🔙 Admin Panel",),
+    ), True),
+    'admin_products': ((
+        ("🛒 Telegram Accounts", "📱 Game Numbers"),
+        ("🔙 Admin Panel",),
+    ), True),
+    'confirm_purchase': ((
+        ("✅ Confirm Purchase", "❌ Cancel"),
+    ), True),
+    'admin_deposit_actions': ((
+        ("✅ Approve", "❌ Reject"),
+        ("🔙 Admin Panel",),
+    ), True),
+    'admin_order_actions': ((
+        ("📱 Send Phone", "🔢 Send OTP"),
+        ("✅ Mark Complete", "🔙 Admin Panel"),
+    ), True),
+    'admin_stock': ((
+        ("➕ Game Stock", "➕ Telegram Stock"),
+        ("🔙 Admin Panel",),
+    ), True),
+    'admin_price': ((
+        ("✏️ Game Price", "✏️ Telegram Price"),
+        ("🔙 Admin Panel",),
+    ), True),
+    'quantity': ((
+        ("➕10", "➕50", "➕100"),
+        ("➕200", "➕500", "➕1000"),
+        ("🔙 Admin Panel",),
+    ), True),
+    'price': ((
+        ("₹50", "₹100", "₹200"),
+        ("₹500", "₹1000", "Custom"),
+        ("🔙 Admin Panel",),
+    ), True),
+}
+
+# Admin listing keyboards: Prev/Next shown only when that page exists,
+# plus any actions specific to the listing
+PAGER_ACTIONS = {
+    'users': (),
+    'pending_orders': (),
+    'pending_deposits': (("✅ Approve Batch", "❌ Reject Batch"),),
+}
+for _listing, _actions in PAGER_ACTIONS.items():
+    for _has_prev in (False, True):
+        for _has_next in (False, True):
+            _nav = tuple(label for label, shown in (("⬅️ Prev", _has_prev), ("➡️ Next", _has_next)) if shown)
+            KEYBOARD_LAYOUTS[('pager', _listing, _has_prev, _has_next)] = (
+                ((_nav,) if _nav else ()) + _actions + (("📤 Export CSV", "🔙 Admin Panel"),),
+                False
+            )
+
+def build_keyboards(layouts):
+    return {
+        name: ReplyKeyboardMarkup(rows, resize_keyboard=True, one_time_keyboard=one_time)
+        for name, (rows, one_time) in layouts.items()
+    }
+
+KEYBOARDS = build_keyboards(KEYBOARD_LAYOUTS)
+
+TEMPLATES = {
+    'welcome': """
+🎮 Welcome to Premium Account Store!
+
+🌟 Available Services:
+
+🛒 Telegram Accounts (12 Countries)
+• India, USA, UK, Brazil, Russia, etc.
+• Fresh & Premium numbers
+• Instant delivery
+
+📱 Game Registration Numbers
+• Any game - Any platform
+• Phone number + OTP delivery
+• One click purchase
+
+💸 Easy Payments:
+• UPI (Instant)
+• Crypto (Bitcoin/USDT)
+
+📞 24/7 Support
+🔒 100% Safe & Secure
+
+Select an option below:
+    """,
+    'profile': """
+👤 Your Profile
+
+User ID: {user_id}
+Username: @{username}
+Name: {full_name}
+
+💰 Balance: ₹{balance:.2f}
+📦 Total Orders: {total_orders}
+💸 Total Spent: ₹{total_spent:.2f}
+📅 Member Since: {member_since}
+            """,
+    'add_balance': (
+        "💸 Select Payment Method:\n\n"
+        "1. UPI - Instant deposit (Recommended)\n"
+        "2. Crypto - Bitcoin/USDT\n\n"
+        "Choose an option:"
+    ),
+}
+
 # ==================== KEYBOARD FUNCTIONS ====================
 def main_menu_keyboard(user_id):
-    if user_id in ADMIN_IDS:
-        keyboard = [
-            ["👤 My Profile", "💰 Add Balance"],
-            ["🛒 Telegram Accounts", "📱 Buy Game Number"],
-            ["📜 My Orders", "📞 Support"],
-            ["🔧 Admin Panel"]
-        ]
-    else:
-        keyboard = [
-            ["👤 My Profile", "💰 Add Balance"],
-            ["🛒 Telegram Accounts", "📱 Buy Game Number"],
-            ["📜 My Orders", "📞 Support"]
-        ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
+    return KEYBOARDS['main_menu_admin' if user_id in ADMIN_IDS else 'main_menu']
 
 def back_to_main_keyboard(user_id):
-    keyboard = [["🔙 Main Menu"]]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['back_to_main']
 
 def payment_methods_keyboard():
-    keyboard = [
-        ["💸 UPI Payment", "₿ Crypto Payment"],
-        ["🔙 Main Menu"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['payment_methods']
 
 def countries_keyboard():
-    countries = get_countries()
+    return catalog.get('countries_keyboard', build_countries_keyboard)
+
+def build_countries_keyboard():
+    countries = get_catalog_countries()
     keyboard = []
     row = []
     for i, country in enumerate(countries):
@@ -391,35 +2282,25 @@ def countries_keyboard():
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
 def admin_menu_keyboard():
-    keyboard = [
-        ["📊 Dashboard", "💰 Pending Deposits"],
-        ["📱 Pending Orders", "👤 All Users"],
-        ["🛒 Products", "⚙️ Settings"],
-        ["➕ Add Stock", "✏️ Edit Price"],
-        ["🔙 Main Menu"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
+    return KEYBOARDS['admin_menu']
 
 def admin_back_keyboard():
-    keyboard = [["🔙 Admin Panel"]]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['admin_back']
+
+def admin_reports_keyboard():
+    return KEYBOARDS['admin_reports']
 
 def admin_settings_keyboard():
-    keyboard = [
-        ["💸 UPI Settings", "₿ Crypto Settings"],
-        ["🔙 Admin Panel"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['admin_settings']
 
 def admin_products_keyboard():
-    keyboard = [
-        ["🛒 Telegram Accounts", "📱 Game Numbers"],
-        ["🔙 Admin Panel"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['admin_products']
 
 def telegram_accounts_keyboard(country_id):
-    accounts = get_telegram_accounts(country_id)
+    return catalog.get(('accounts_keyboard', country_id), lambda: build_telegram_accounts_keyboard(country_id))
+
+def build_telegram_accounts_keyboard(country_id):
+    accounts = get_catalog_accounts(country_id)
     keyboard = []
     for account in accounts:
         keyboard.append([f"📱 {account['account_type']} - ₹{account['price']}"])
@@ -427,138 +2308,1058 @@ def telegram_accounts_keyboard(country_id):
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
 def confirm_purchase_keyboard():
-    keyboard = [
-        ["✅ Confirm Purchase", "❌ Cancel"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['confirm_purchase']
 
 def admin_deposit_actions_keyboard(deposit_id):
-    keyboard = [
-        ["✅ Approve", "❌ Reject"],
-        ["🔙 Admin Panel"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['admin_deposit_actions']
 
 def admin_order_actions_keyboard():
-    keyboard = [
-        ["📱 Send Phone", "🔢 Send OTP"],
-        ["✅ Mark Complete", "🔙 Admin Panel"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['admin_order_actions']
 
 def admin_stock_keyboard():
-    keyboard = [
-        ["➕ Game Stock", "➕ Telegram Stock"],
-        ["🔙 Admin Panel"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['admin_stock']
 
 def admin_price_keyboard():
-    keyboard = [
-        ["✏️ Game Price", "✏️ Telegram Price"],
-        ["🔙 Admin Panel"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['admin_price']
 
 def quantity_keyboard():
-    keyboard = [
-        ["➕10", "➕50", "➕100"],
-        ["➕200", "➕500", "➕1000"],
-        ["🔙 Admin Panel"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['quantity']
 
 def price_keyboard():
-    keyboard = [
-        ["₹50", "₹100", "₹200"],
-        ["₹500", "₹1000", "Custom"],
-        ["🔙 Admin Panel"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+    return KEYBOARDS['price']
 
-# ==================== MESSAGE HANDLERS ====================
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    create_user(user.id, user.username, user.full_name)
-    
-    welcome_text = """
-🎮 Welcome to Premium Account Store!
+def pager_keyboard(page, listing):
+    return KEYBOARDS[('pager', listing, bool(page['prev']), bool(page['next']))]
 
-🌟 Available Services:
+# ==================== ROUTER ====================
+# Text updates are dispatched through a dict keyed on (state, button text)
+# instead of an if/elif chain. Routes registered with state=None are global:
+# they match in every conversation state, which is what the persistent main
+# menu keyboard needs. Admin-only routes are invisible to other users.
+class Router:
+    def __init__(self):
+        self._routes = {}
+        self._fallbacks = {}
 
-🛒 Telegram Accounts (12 Countries)
-• India, USA, UK, Brazil, Russia, etc.
-• Fresh & Premium numbers
-• Instant delivery
+    def route(self, text, state=None, admin=False):
+        def register(handler):
+            self._routes[(state, text)] = (handler, admin)
+            return handler
+        return register
 
-📱 Game Registration Numbers
-• Any game - Any platform
-• Phone number + OTP delivery
-• One click purchase
+    def fallback(self, state=None):
+        def register(handler):
+            self._fallbacks[state] = handler
+            return handler
+        return register
 
-💸 Easy Payments:
-• UPI (Instant)
-• Crypto (Bitcoin/USDT)
+    def resolve(self, state, text, user_id):
+        for key in ((state, text), (None, text)):
+            entry = self._routes.get(key)
+            if entry is not None:
+                handler, admin = entry
+                if not admin or user_id in ADMIN_IDS:
+                    return handler
+        return self._fallbacks.get(state) or self._fallbacks.get(None)
 
-📞 24/7 Support
-🔒 100% Safe & Secure
+    async def dispatch(self, update, context, state=MAIN_MENU):
+        handler = self.resolve(state, update.message.text, update.effective_user.id)
+        if handler is None:
+            return None
+        with metrics.timer(f"handler:{handler.__name__}"):
+            return await handler(update, context)
 
-Select an option below:
-    """
+    def handler_for(self, state):
+        async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            return await self.dispatch(update, context, state)
+        return handle
+
+    # Per-state handlers for a ConversationHandler, so every state a route
+    # can return is reachable
+    def conversation_states(self):
+        from telegram.ext import MessageHandler, filters
+
+        text_filter = filters.TEXT & ~filters.COMMAND
+        return {
+            state: [MessageHandler(text_filter, self.handler_for(state))]
+            for state in CONVERSATION_STATES
+        }
+
+router = Router()
+
+# ==================== MESSAGE HANDLERS ====================
+@timed("handler:start")
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user_cache.get(user.id) is None:
+        await run_db(create_user, user.id, user.username, user.full_name)
+    
     await update.message.reply_text(
-        welcome_text,
+        TEMPLATES['welcome'],
         reply_markup=main_menu_keyboard(user.id)
     )
     return MAIN_MENU
 
 # ==================== USER PANEL HANDLERS ====================
 async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await router.dispatch(update, context, MAIN_MENU)
+
+@router.route("🔙 Main Menu")
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "Select an option below:",
+        reply_markup=main_menu_keyboard(update.effective_user.id)
+    )
+    return MAIN_MENU
+
+@router.route("👤 My Profile")
+async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    text = update.message.text
-    
-    if text == "👤 My Profile":
-        user = get_user(user_id)
-        if user:
-            profile_text = f"""
-👤 Your Profile
+    user = user_cache.get(user_id) or await run_db(get_user, user_id)
+    if user:
+        profile_text = TEMPLATES['profile'].format(
+            user_id=user['user_id'],
+            username=user['username'] or 'N/A',
+            full_name=user['full_name'],
+            balance=user['balance'],
+            total_orders=user['total_orders'],
+            total_spent=user['total_spent'],
+            member_since=user['join_date'][:10]
+        )
+        await update.message.reply_text(
+            profile_text,
+            reply_markup=main_menu_keyboard(user_id)
+        )
+    return MAIN_MENU
+
+@router.route("📜 My Orders")
+async def show_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    orders = await run_db(get_user_orders, user_id)
+    if orders:
+        lines = ["📜 Your Recent Orders\n"]
+        for order in orders:
+            lines.append(f"{order['order_id']} • ₹{order['amount']:.2f} • {order['status']} • {order['order_date'][:10]}")
+        text = "\n".join(lines)
+    else:
+        text = "📜 You have no orders yet."
+    await update.message.reply_text(text, reply_markup=main_menu_keyboard(user_id))
+    return MAIN_MENU
+
+@router.route("💰 Add Balance")
+async def show_payment_methods(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        TEMPLATES['add_balance'],
+        reply_markup=payment_methods_keyboard()
+        )
+    return ADD_BALANCE
+
+# ==================== ADMIN PANEL HANDLERS ====================
+@router.route("🔧 Admin Panel", admin=True)
+@router.route("🔙 Admin Panel", admin=True)
+async def show_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "🔧 Admin Panel",
+        reply_markup=admin_menu_keyboard()
+    )
+    return ADMIN_MENU
+
+@router.route("📊 Dashboard", state=ADMIN_MENU, admin=True)
+async def show_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    stats = await run_db(get_system_stats)
+    await update.message.reply_text(
+        "📊 Dashboard\n\n"
+        f"👤 Users: {stats['total_users']}\n"
+        f"📦 Orders: {stats['total_orders']}\n"
+        f"💸 Sales: ₹{stats['total_sales']:.2f}\n"
+        f"💰 Pending Deposits: {stats['pending_deposits']}\n"
+        f"📱 Pending Orders: {stats['pending_orders']}\n"
+        f"🏦 User Balances: ₹{stats['total_balance']:.2f}",
+        reply_markup=admin_menu_keyboard()
+    )
+    return ADMIN_MENU
 
-User ID: {user['user_id']}
-Username: @{user['username'] if user['username'] else 'N/A'}
-Name: {user['full_name']}
-
-💰 Balance: ₹{user['balance']:.2f}
-📦 Total Orders: {user['total_orders']}
-💸 Total Spent: ₹{user['total_spent']:.2f}
-📅 Member Since: {user['join_date'][:10]}
-            """
-            await update.message.reply_text(
-                profile_text,
-                reply_markup=main_menu_keyboard(user_id)
+# Listing name -> (conversation state, title, row formatter)
+ADMIN_LISTINGS = {
+    'users': (ADMIN_USERS, "👤 All Users", lambda row: (
+        f"{row['user_id']} • @{row['username'] or 'N/A'} • ₹{row['balance']:.2f} • {(row['join_date'] or '')[:10]}"
+    )),
+    'pending_orders': (ADMIN_ORDERS, "📱 Pending Orders", lambda row: (
+        f"{row['order_id']} • user {row['user_id']} • {row['product_type']} • ₹{row['amount']:.2f} • {(row['order_date'] or '')[:16]}"
+    )),
+    'pending_deposits': (ADMIN_DEPOSITS, "💰 Pending Deposits", lambda row: (
+        f"{row['deposit_id']} • user {row['user_id']} • {row['method']} • ₹{row['amount']:.2f} • {(row['request_date'] or '')[:16]}"
+    )),
+}
+LISTING_BY_STATE = {state: listing for listing, (state, _, _) in ADMIN_LISTINGS.items()}
+
+async def show_listing_page(update, context, listing, cursor=None):
+    state, title, format_row = ADMIN_LISTINGS[listing]
+    page = await run_db(get_page, listing, cursor)
+    context.user_data['page'] = page
+    if page['rows']:
+        text = "\n".join([title, ""] + [format_row(row) for row in page['rows']])
+    else:
+        text = f"{title}\n\nNothing here."
+    await update.message.reply_text(text, reply_markup=pager_keyboard(page, listing))
+    return state
+
+@router.route("👤 All Users", state=ADMIN_MENU, admin=True)
+async def show_all_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await show_listing_page(update, context, 'users')
+
+@router.route("📱 Pending Orders", state=ADMIN_MENU, admin=True)
+async def show_pending_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await show_listing_page(update, context, 'pending_orders')
+
+@router.route("💰 Pending Deposits", state=ADMIN_MENU, admin=True)
+async def show_pending_deposits(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await show_listing_page(update, context, 'pending_deposits')
+
+def _register_pager_routes(state):
+    listing = LISTING_BY_STATE[state]
+
+    @router.route("➡️ Next", state=state, admin=True)
+    @router.route("⬅️ Prev", state=state, admin=True)
+    async def turn_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        page = context.user_data.get('page') or {}
+        cursor = page.get('next' if update.message.text == "➡️ Next" else 'prev')
+        return await show_listing_page(update, context, listing, cursor)
+
+    @router.route("📤 Export CSV", state=state, admin=True)
+    async def export_listing(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        export = await run_db(export_listing_csv, listing)
+        with export:
+            await update.message.reply_document(
+                export,
+                filename=f"{listing}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
             )
+        return state
+
+for _state in LISTING_BY_STATE:
+    _register_pager_routes(_state)
+
+DEPOSIT_ID_PATTERN = re.compile(r"DEP[0-9A-Z]+")
+
+@router.route("✅ Approve Batch", state=ADMIN_DEPOSITS, admin=True)
+@router.route("❌ Reject Batch", state=ADMIN_DEPOSITS, admin=True)
+async def ask_deposit_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    approve = update.message.text == "✅ Approve Batch"
+    context.user_data['approve_deposits'] = approve
+    await update.message.reply_text(
+        f"{'✅ Approve' if approve else '❌ Reject'} deposits\n\n"
+        "Send the deposit IDs, separated by spaces or new lines, "
+        "or \"page\" for every deposit on the page shown.",
+        reply_markup=admin_back_keyboard()
+    )
+    return ADMIN_DEPOSIT_BATCH
+
+@router.fallback(state=ADMIN_DEPOSIT_BATCH)
+async def run_deposit_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
         return MAIN_MENU
-    
-    elif text == "💰 Add Balance":
-        await update.message.reply_text(
-            "💸 Select Payment Method:\n\n"
-            "1. UPI - Instant deposit (Recommended)\n"
-            "2. Crypto - Bitcoin/USDT\n\n"
-            "Choose an option:",
-            reply_markup=payment_methods_keyboard()
+    text = update.message.text
+    if text.strip().lower() == 'page':
+        page = context.user_data.get('page') or {}
+        deposit_ids = [row['deposit_id'] for row in page.get('rows', ()) if 'deposit_id' in row]
+    else:
+        deposit_ids = DEPOSIT_ID_PATTERN.findall(text.upper())
+    if not deposit_ids:
+        await update.message.reply_text("No deposit IDs found, try again:", reply_markup=admin_back_keyboard())
+        return ADMIN_DEPOSIT_BATCH
+
+    results = await run_db(
+        process_deposits, deposit_ids, update.effective_user.id,
+        approve=context.user_data.get('approve_deposits', True)
+    )
+    counts = {}
+    for result in results.values():
+        counts[result] = counts.get(result, 0) + 1
+    lines = ["📋 Batch result: " + ", ".join(f"{result} {count}" for result, count in sorted(counts.items())), ""]
+    lines += [f"{deposit_id}: {result}" for deposit_id, result in results.items()]
+    report = "\n".join(lines)
+    if len(report) > MESSAGE_LIMIT:
+        report = report[:MESSAGE_LIMIT - 2] + "\n…"
+    await update.message.reply_text(report, reply_markup=admin_menu_keyboard())
+    return ADMIN_MENU
+
+@router.route("📢 Broadcast", state=ADMIN_MENU, admin=True)
+async def ask_broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "📢 Send the message to broadcast to every user:",
+        reply_markup=admin_back_keyboard()
+    )
+    return ADMIN_BROADCAST
+
+@router.fallback(state=ADMIN_BROADCAST)
+async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return MAIN_MENU
+    text = update.message.text
+    # Every shard messages its own users at its own share of the rate
+    started = await run_db(lambda: list(on_every_shard('broadcast', text=text)))
+    users = sum(count for _, count in started if count is not None)
+    reply = f"📢 Broadcast started for {users} users..."
+    missing = [shard for shard, count in started if count is None]
+    if missing:
+        reply += f"\n⚠️ Shard(s) {missing} did not answer; their users are skipped"
+    await update.message.reply_text(reply, reply_markup=admin_menu_keyboard())
+    return ADMIN_MENU
+
+# Admins upload a CSV/JSONL file captioned "/import <game|telegram> <product_id>"
+IMPORT_CAPTION = re.compile(r"^/import\s+(game|telegram)\s+(\d+)\s*$")
+
+async def import_stock_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    match = IMPORT_CAPTION.match(update.message.caption or "")
+    if not match:
+        await update.message.reply_text("Caption the file with /import <game|telegram> <product_id>")
+        return
+    product_type, product_id = match.group(1), int(match.group(2))
+    document = update.message.document
+    status = await update.message.reply_text("📥 Import started...")
+    loop = asyncio.get_running_loop()
+    last_progress = [0.0]
+
+    # Called from the import thread; edits the status message at most every 2s
+    def progress(report):
+        now = time.monotonic()
+        if now - last_progress[0] >= 2:
+            last_progress[0] = now
+            asyncio.run_coroutine_threadsafe(status.edit_text(format_import_report(report)), loop)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Only the extension of the sender's filename is used (it picks the format)
+        extension = os.path.splitext(os.path.basename(document.file_name or ""))[1].lower()
+        path = os.path.join(workdir, "import" + (extension or ".csv"))
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        try:
+            report = await run_db(import_inventory, path, product_type, product_id, progress=progress)
+        except ValueError as e:
+            await status.edit_text(f"❌ {e}")
+            return
+    await status.edit_text("✅ Import finished\n" + format_import_report(report))
+
+@router.route("📈 Metrics", state=ADMIN_MENU, admin=True)
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    snapshot = metrics.snapshot()
+    slowest = sorted(snapshot['latency'].items(), key=lambda item: item[1]['total_ms'], reverse=True)[:15]
+    lines = ["📈 Metrics (by total time)", ""]
+    for name, summary in slowest:
+        lines.append(
+            f"{name[:60]}\n   n={summary['count']} p50={summary['p50_ms']}ms "
+            f"p99={summary['p99_ms']}ms max={summary['max_ms']}ms"
+        )
+    lines.append("")
+    for name, value in snapshot['gauges'].items():
+        lines.append(f"{name}: {value}")
+    text = "\n".join(lines)
+    await update.message.reply_text(text[:MESSAGE_LIMIT], reply_markup=admin_menu_keyboard())
+    return ADMIN_MENU
+
+REPORT_PERIODS = {"💹 Sales Report": 7, "📅 7 Days": 7, "🗓 30 Days": 30}
+
+@router.route("💹 Sales Report", state=ADMIN_MENU, admin=True)
+@router.route("📅 7 Days", state=ADMIN_REPORTS, admin=True)
+@router.route("🗓 30 Days", state=ADMIN_REPORTS, admin=True)
+async def show_sales_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    days = REPORT_PERIODS[update.message.text]
+    context.user_data['report_days'] = days
+    report = await run_db(get_sales_report, days)
+    count, amount = report['last_24h']
+    lines = [f"💹 Sales Report • last {days} days (UTC)", "", f"⏱ Last 24 hours: {count} orders • ₹{amount:.2f}", "", "📅 By day"]
+    lines += [f"{day} • {count} orders • ₹{amount:.2f}" for day, (count, amount) in report['by_day'].items()]
+    if not report['by_day']:
+        lines.append("No delivered orders.")
+    for metric, title in ROLLUP_METRICS.items():
+        totals = sorted(report['by_metric'][metric].items(), key=lambda item: item[1][1], reverse=True)
+        lines += ["", title]
+        lines += [f"{key} • {count} • ₹{amount:.2f}" for key, (count, amount) in totals] or ["Nothing yet."]
+    text = "\n".join(lines)
+    if len(text) > MESSAGE_LIMIT:
+        text = text[:MESSAGE_LIMIT - 2] + "\n…"
+    await update.message.reply_text(text, reply_markup=admin_reports_keyboard())
+    return ADMIN_REPORTS
+
+@router.route("📤 Daily CSV", state=ADMIN_REPORTS, admin=True)
+@router.route("📤 Hourly CSV", state=ADMIN_REPORTS, admin=True)
+async def export_sales_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    grain = 'day' if update.message.text == "📤 Daily CSV" else 'hour'
+    days = context.user_data.get('report_days', 7)
+    export = await run_db(export_rollups_csv, grain, days)
+    with export:
+        await update.message.reply_document(
+            export,
+            filename=f"sales_{grain}_{days}d_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        )
+    return ADMIN_REPORTS
+
+# ==================== BACKGROUND JOBS ====================
+_background_tasks = set()
+_event_loop = None
+
+async def run_periodically(interval, func, *args):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_db(func, *args)
+        except Exception:
+            logging.exception("Background job %s failed", func.__name__)
+
+def start_background_task(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def register_gauges(application):
+    metrics.gauge("db:connections", lambda: len(_db_connections))
+    metrics.gauge("update:queue_size", application.update_queue.qsize)
+    metrics.gauge("update:scheduler", application.update_processor.stats)
+    metrics.gauge("send_queue", send_queue.stats)
+    metrics.gauge("activity", activity.stats)
+    metrics.gauge("user_cache", lambda: {
+        'size': len(user_cache._users), 'hits': user_cache.hits, 'misses': user_cache.misses
+    })
+    metrics.gauge("catalog_version", lambda: catalog.version)
+
+async def post_init(application):
+    global _event_loop
+    _event_loop = asyncio.get_running_loop()
+    register_gauges(application)
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT + SHARD_ID)
+    await send_queue.start(application.bot)
+    if STATS_RECONCILE_INTERVAL:
+        start_background_task(run_periodically(STATS_RECONCILE_INTERVAL, reconcile_stats))
+    start_background_task(run_periodically(ACTIVITY_FLUSH_INTERVAL, activity.flush))
+    if CATALOG_DB_PATH:
+        start_background_task(run_periodically(CATALOG_SYNC_INTERVAL, sync_catalog))
+    if SHARD_ID != 0:
+        start_background_task(run_periodically(ADMIN_FORWARD_INTERVAL, forward_admin_alerts))
+
+async def post_stop(application):
+    await send_queue.stop()
+
+async def post_shutdown(application):
+    tasks = list(_background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await run_db(activity.flush)
+    if SHARD_ID != 0:
+        try:
+            await run_db(forward_admin_alerts)
+        except Exception:
+            logging.exception("Could not forward the last admin alerts")
+
+# ==================== UPDATE SCHEDULER ====================
+# Updates from different users run in parallel (up to max_concurrent_updates),
+# but each user's updates run strictly one after another in arrival order,
+# so conversation state, balances and orders never interleave for one user.
+# A user's backlog is queued outside the concurrency limit: only the update
+# currently running for a user occupies a worker slot.
+# The scheduling logic lives in a plain mixin; the BaseUpdateProcessor
+# subclass is assembled in create_update_processor once telegram.ext is loaded.
+class PerUserScheduling:
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._pending = {}
+        self.active = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.processed = 0
+
+    @staticmethod
+    def ordering_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def _run(self, coroutine):
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            await coroutine
+        except Exception:
+            logging.exception("Update processing failed")
+        finally:
+            metrics.observe("update:processing", time.perf_counter() - started)
+            self.active -= 1
+            self.processed += 1
+
+    async def do_process_update(self, update, coroutine):
+        # Age since Telegram created the update (1s resolution): end-to-end lag
+        message = getattr(update, 'effective_message', None)
+        if message is not None and message.date is not None:
+            metrics.observe("update:age", max(datetime.now(timezone.utc).timestamp() - message.date.timestamp(), 0))
+        key = self.ordering_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.append((time.perf_counter(), coroutine))
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            return
+        pending = self._pending[key] = deque()
+        try:
+            await self._run(coroutine)
+            while pending:
+                self.queued -= 1
+                queued_at, next_coroutine = pending.popleft()
+                metrics.observe("update:user_queue_wait", time.perf_counter() - queued_at)
+                await self._run(next_coroutine)
+        finally:
+            del self._pending[key]
+            for _, leftover in pending:
+                leftover.close()
+            self.queued -= len(pending)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {
+            'max_concurrent_updates': self.max_concurrent_updates,
+            'active': self.active,
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'busy_users': len(self._pending),
+            'processed': self.processed,
+        }
+
+def create_update_processor(max_concurrent_updates):
+    from telegram.ext import BaseUpdateProcessor
+
+    class PerUserUpdateProcessor(PerUserScheduling, BaseUpdateProcessor):
+        pass
+
+    return PerUserUpdateProcessor(max_concurrent_updates)
+
+# ==================== SHARDED DEPLOYMENT ====================
+# serve-shards runs an ingress process plus SHARD_COUNT worker processes.
+# The ingress receives Telegram's webhook POSTs and forwards each update to
+# the worker that owns its user; every worker is a complete bot for its own
+# users, with its own update processor, caches and send queue. Workers call
+# each other on the same local endpoint for admin writes to another shard.
+SHARD_RPC = {
+    'process_deposits': process_shard_deposits,
+    'complete_order': complete_shard_order,
+    'broadcast': start_shard_broadcast,
+    'notify_admins': queue_admin_alerts,
+}
+
+def _post_json(url, payload, headers=None, timeout=30):
+    import urllib.request
+
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(),
+        headers={'Content-Type': 'application/json', **(headers or {})}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def call_shard(shard, name, **kwargs):
+    return _post_json(
+        f"http://127.0.0.1:{SHARD_BASE_PORT + shard}/rpc/{name}", kwargs, {'X-Shard-Secret': SHARD_SECRET}
+    )
+
+# The user an update belongs to, read from the raw JSON the same way
+# PerUserScheduling.ordering_key reads it: sender first, then chat
+def update_owner(data):
+    for value in data.values():
+        if isinstance(value, dict):
+            for field in ('from', 'user', 'chat'):
+                sender = value.get(field)
+                if isinstance(sender, dict) and 'id' in sender:
+                    return sender['id']
+    return 0
+
+def _json_handler(routes, secret_header, secret):
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if secret and self.headers.get(secret_header) != secret:
+                self.reply(403)
+                return
+            route = routes.get(self.path.split('?', 1)[0])
+            if route is None:
+                self.reply(404)
+                return
+            try:
+                status, payload = route(body)
+            except Exception:
+                logging.exception("Request to %s failed", self.path)
+                status, payload = 500, None
+            self.reply(status, payload)
+
+        def reply(self, status, payload=None):
+            data = json.dumps(payload).encode() if payload is not None else b""
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def _serve(listen, port, handler, name):
+    from http.server import ThreadingHTTPServer
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        # Telegram opens up to 40 connections at once; the default backlog is 5
+        request_queue_size = 128
+
+    server = Server((listen, port), handler)
+    threading.Thread(target=server.serve_forever, name=name, daemon=True).start()
+    return server
+
+# Worker side: updates go onto the application's queue, RPCs run in the
+# request thread like any other blocking DB call
+def serve_shard_intake(application, loop):
+    def take_update(body):
+        update = Update.de_json(json.loads(body), application.bot)
+        loop.call_soon_threadsafe(application.update_queue.put_nowait, update)
+        return 200, None
+
+    routes = {'/update': take_update}
+    for name, func in SHARD_RPC.items():
+        routes[f'/rpc/{name}'] = lambda body, func=func: (200, func(**json.loads(body)))
+    handler = _json_handler(routes, 'X-Shard-Secret', SHARD_SECRET)
+    return _serve('127.0.0.1', SHARD_BASE_PORT + SHARD_ID, handler, f"shard-{SHARD_ID}")
+
+# Same lifecycle as Application.run_webhook, minus the updater: the
+# ingress owns the webhook and this worker only receives forwarded updates
+async def run_shard_worker(application):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await application.initialize()
+    try:
+        await post_init(application)
+        await application.start()
+        server = serve_shard_intake(application, loop)
+        logging.info("Shard %d/%d listening on port %d", SHARD_ID, SHARD_COUNT, SHARD_BASE_PORT + SHARD_ID)
+        await stop.wait()
+        server.shutdown()
+        await application.stop()
+        await post_stop(application)
+    finally:
+        await application.shutdown()
+        await post_shutdown(application)
+
+# Ingress side: one keep-alive connection per request thread and shard
+def serve_ingress(secret):
+    import http.client
+
+    local = threading.local()
+
+    def forward(body):
+        shard = shard_for(update_owner(json.loads(body)))
+        connections = local.__dict__.setdefault('connections', {})
+        started = time.perf_counter()
+        for _ in range(2):
+            conn = connections.get(shard)
+            if conn is None:
+                conn = connections[shard] = http.client.HTTPConnection('127.0.0.1', SHARD_BASE_PORT + shard, timeout=30)
+            try:
+                conn.request('POST', '/update', body, {'Content-Type': 'application/json', 'X-Shard-Secret': secret})
+                response = conn.getresponse()
+                response.read()
+                metrics.observe(f"ingress:shard{shard}", time.perf_counter() - started)
+                return response.status, None
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                del connections[shard]
+        # Telegram retries updates that weren't accepted
+        return 503, None
+
+    handler = _json_handler({f"/{WEBHOOK_PATH.strip('/')}": forward}, 'X-Telegram-Bot-Api-Secret-Token', WEBHOOK_SECRET)
+    return _serve(WEBHOOK_LISTEN, WEBHOOK_PORT, handler, "ingress")
+
+def set_webhook():
+    api = (BOT_API_URL or "https://api.telegram.org").rstrip('/')
+    params = {'url': f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"}
+    if WEBHOOK_SECRET:
+        params['secret_token'] = WEBHOOK_SECRET
+    result = _post_json(f"{api}/bot{BOT_TOKEN}/setWebhook", params)
+    if not result.get('ok'):
+        raise RuntimeError(f"setWebhook failed: {result}")
+
+def wait_for_shard(shard, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', SHARD_BASE_PORT + shard), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+# Point the storage layer at another shard's file (for migrating them all)
+def use_shard(shard):
+    global SHARD_ID
+    close_db()
+    SHARD_ID = shard
+
+# Migrate every shard's file, and the catalog, from this one process
+def migrate_shards():
+    for shard in range(SHARD_COUNT):
+        use_shard(shard)
+        version = init_db()
+    use_shard(0)
+    return version
+
+# ==================== RESHARDING ====================
+# Moves every row into the layout for another SHARD_COUNT: users and their
+# orders and deposits to shard user_id % count, the catalog into the catalog
+# file (or back into DB_PATH for a single shard) and the rollups into shard
+# 0, since reports add them up over every shard. The new files are built
+# beside the old ones and swapped in only once the row counts match; the old
+# files are kept with a .bak suffix. The bot must be stopped.
+SHARDED_TABLES = ('users', 'orders', 'deposits')
+
+def current_shard_count():
+    first_shard = shard_layout(2, _db_root)[0][0]
+    if os.path.exists(DB_PATH):
+        if os.path.exists(first_shard):
+            raise RuntimeError(f"Both {DB_PATH} and {first_shard} exist; move the one that is not in use away")
+        return 1
+    if not os.path.exists(first_shard):
+        return None
+    with closing(sqlite3.connect(f"file:{first_shard}?mode=ro", uri=True)) as conn:
+        try:
+            return conn.execute("SELECT shard_count FROM shard_meta").fetchone()[0]
+        except sqlite3.OperationalError:
+            raise RuntimeError(f"{first_shard} has no shard metadata; run `python main.py migrate` with its SHARD_COUNT first")
+
+def _columns(conn, table, schema="main", skip=()):
+    return ", ".join(row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})") if row[1] not in skip)
+
+def _row_counts(paths, tables):
+    counts = dict.fromkeys(tables, 0)
+    for path in paths:
+        with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+            for table in tables:
+                counts[table] += conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return counts
+
+# Copy tables from the file at source_path into conn's main database. Row
+# ids of orders and deposits are only unique within one shard, so merged
+# rows get new ones.
+def _copy_rows(conn, source_path, statements):
+    conn.execute("ATTACH DATABASE ? AS source", (f"file:{source_path}?mode=ro",))
+    conn.execute("BEGIN IMMEDIATE")
+    for query, params in statements:
+        conn.execute(query, params)
+    conn.execute("COMMIT")
+    conn.execute("DETACH DATABASE source")
+
+def _move_db_file(path, new_path):
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.replace(path + suffix, new_path + suffix)
+
+def _migrate_layout(db_path, count):
+    env = dict(os.environ, DB_PATH=db_path, SHARD_COUNT=str(count))
+    env.pop("SHARD_ID", None)
+    if db_path != DB_PATH:
+        env.pop("CATALOG_DB_PATH", None)
+    subprocess.run([sys.executable, os.path.abspath(__file__), "migrate"], env=env, check=True, stdout=subprocess.DEVNULL)
+
+def reshard(count):
+    current = current_shard_count()
+    if current is None:
+        raise RuntimeError(f"No database at {DB_PATH} to reshard")
+    if current == count:
+        return None
+    sources, source_catalog = shard_layout(current, _db_root)
+    # Brings the old files to the current schema and repairs a purchase a
+    # crash left half-committed, so the copy starts from a consistent state
+    _migrate_layout(DB_PATH, current)
+
+    work_root = f"{_db_root}.reshard"
+    targets, target_catalog = shard_layout(count, work_root)
+    for path in targets + [target_catalog]:
+        for suffix in ("", "-wal", "-shm"):
+            if path and os.path.exists(path + suffix):
+                os.remove(path + suffix)  # left over from an interrupted run
+    _migrate_layout(work_root + _db_ext, count)
+
+    for shard, path in enumerate(targets):
+        with closing(sqlite3.connect(f"file:{path}", uri=True, isolation_level=None)) as conn:
+            statements = []
+            for table in SHARDED_TABLES:
+                columns = _columns(conn, table, skip=('id',))
+                statements.append((
+                    f"INSERT INTO main.{table} ({columns}) SELECT {columns} FROM source.{table} "
+                    "WHERE user_id % ? = ? ORDER BY rowid",
+                    (count, shard)
+                ))
+            if shard == 0:
+                for table, _ in ROLLUP_GRAINS.values():
+                    statements.append((
+                        f"INSERT INTO main.{table} (metric, bucket, key, count, amount) "
+                        f"SELECT metric, bucket, key, count, amount FROM source.{table} WHERE 1 "
+                        "ON CONFLICT (metric, bucket, key) DO UPDATE SET "
+                        "count = count + excluded.count, amount = amount + excluded.amount",
+                        ()
+                    ))
+            for source in sources:
+                _copy_rows(conn, source, statements)
+            conn.execute("BEGIN IMMEDIATE")
+            _recount_stats(conn.cursor())
+            conn.execute("COMMIT")
+
+    with closing(sqlite3.connect(f"file:{target_catalog or targets[0]}", uri=True, isolation_level=None)) as conn:
+        _copy_rows(conn, source_catalog or sources[0], [
+            (f"INSERT INTO main.{table} ({_columns(conn, table)}) SELECT {_columns(conn, table)} FROM source.{table}", ())
+            for table in CATALOG_TABLES
+        ])
+        if target_catalog:
+            last_orders = []
+            for shard, path in enumerate(targets):
+                with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as shard_conn:
+                    last_orders += [(shard, *row) for row in shard_conn.execute(
+                        "SELECT order_id, product_type, product_id FROM orders ORDER BY id DESC LIMIT 1"
+                    )]
+            conn.executemany(
+                "INSERT INTO shard_purchases (shard, last_order_id, product_type, product_id) VALUES (?, ?, ?, ?)",
+                last_orders
             )
+
+    before = _row_counts(sources, SHARDED_TABLES), _row_counts([source_catalog or sources[0]], CATALOG_TABLES)
+    after = _row_counts(targets, SHARDED_TABLES), _row_counts([target_catalog or targets[0]], CATALOG_TABLES)
+    if before != after:
+        raise RuntimeError(f"Row counts differ after copying ({before} before, {after} after); the old files are untouched")
+
+    stamp = time.strftime("%Y%m%d%H%M%S")
+    for path in sources + [source_catalog]:
+        if path:
+            _move_db_file(path, f"{path}.{stamp}.bak")
+    finals, final_catalog = shard_layout(count, _db_root)
+    for path, final in zip(targets + [target_catalog], finals + [final_catalog]):
+        if path:
+            _move_db_file(path, final)
+    return after[0]
+
 # ==================== MAIN RUNNER ====================
+# updater=False for shard workers, which are fed by the ingress instead
+def build_application(updater=True):
+    from telegram.ext import Application, TypeHandler, CommandHandler, MessageHandler, filters, ConversationHandler
+
+    if not BOT_TOKEN:
+        raise RuntimeError("BOT_TOKEN not found in environment variables")
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(create_update_processor(CONCURRENT_UPDATES))
+        .connection_pool_size(CONNECTION_POOL_SIZE)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL.rstrip('/')}/bot").base_file_url(f"{BOT_API_URL.rstrip('/')}/file/bot")
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # Runs ahead of the conversation for every update
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
+
+    # BASIC HANDLERS
+    application.add_handler(ConversationHandler(
+        entry_points=[
+            CommandHandler("start", start),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, handle_main_menu)
+        ],
+        states=router.conversation_states(),
+        fallbacks=[CommandHandler("start", start)]
+    ))
+    application.add_handler(MessageHandler(filters.Document.ALL, import_stock_document))
+    return application
+
 def main():
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    started = time.perf_counter()
     init_db()
+    warm_catalog()
+    if not get_catalog_countries():
+        logging.warning("Catalog is empty; run `python main.py seed` to load the default products")
+    application = build_application()
+    logging.info("Startup took %.0f ms", (time.perf_counter() - started) * 1000)
 
-    application = Application.builder().token(BOT_TOKEN).build()
+    print(f"✅ Bot started successfully ({BOT_MODE})...")
+    try:
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("WEBHOOK_URL is required in webhook mode")
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET
+            )
+        else:
+            application.run_polling()
+    finally:
+        close_db()
 
-    # BASIC HANDLERS
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_main_menu)
+def import_stock_command(args):
+    init_db()
+    try:
+        report = import_inventory(
+            args.path, args.product_type, args.product_id, fmt=args.format,
+            progress=lambda report: print(format_import_report(report), flush=True)
+        )
+    finally:
+        close_db()
+    print("✅ Import finished\n" + format_import_report(report))
+
+def migrate_command(args):
+    try:
+        version = migrate_shards()
+    finally:
+        close_db()
+    print(f"✅ Schema at version {version}")
+
+def seed_command(args):
+    try:
+        init_db()
+        seed_db()
+    finally:
+        close_db()
+    print("✅ Default catalog and payment methods loaded")
+
+def reshard_command(args):
+    if args.shards < 1:
+        raise SystemExit("The shard count must be 1 or more")
+    counts = reshard(args.shards)
+    if counts is None:
+        print(f"✅ Already {args.shards} shard(s)")
+        return
+    print(f"✅ Moved {counts['users']} users, {counts['orders']} orders and {counts['deposits']} deposits "
+          f"into {args.shards} shard(s); start the bot with SHARD_COUNT={args.shards}")
+
+def serve_shards_command(args):
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
     )
+    if SHARD_COUNT < 2:
+        raise RuntimeError("Set SHARD_COUNT to 2 or more to run sharded")
+    if not BOT_TOKEN or not WEBHOOK_URL:
+        raise RuntimeError("BOT_TOKEN and WEBHOOK_URL are required to run sharded")
+    # Migrate every shard up front so workers start on the fast path
+    migrate_shards()
+
+    env = dict(os.environ, SHARD_SECRET=SHARD_SECRET or secrets.token_urlsafe(24))
+
+    def spawn(shard):
+        return subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "shard-worker"], env=dict(env, SHARD_ID=str(shard))
+        )
+
+    workers = [spawn(shard) for shard in range(SHARD_COUNT)]
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    server = None
+    try:
+        for shard in range(SHARD_COUNT):
+            if not wait_for_shard(shard):
+                raise RuntimeError(f"Shard {shard} did not start")
+        server = serve_ingress(env['SHARD_SECRET'])
+        set_webhook()
+        print(f"✅ Ingress on port {WEBHOOK_PORT} with {SHARD_COUNT} shards")
+        while not stop.wait(1):
+            for shard, process in enumerate(workers):
+                if process.poll() is not None:
+                    logging.error("Shard %d exited with code %s, restarting", shard, process.returncode)
+                    workers[shard] = spawn(shard)
+    finally:
+        if server is not None:
+            server.shutdown()
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
 
-    print("✅ Bot started successfully...")
-    application.run_polling()
+def shard_worker_command(args):
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format=f"%(asctime)s %(levelname)s shard{SHARD_ID} %(name)s: %(message)s"
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    init_db()
+    warm_catalog()
+    try:
+        asyncio.run(run_shard_worker(build_application(updater=False)))
+    finally:
+        close_db()
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Premium Account Store bot")
+    sub = parser.add_subparsers(dest="command")
+
+    sub.add_parser("run", help="run the bot (default)")
+    sub.add_parser("migrate", help="apply pending schema migrations")
+    sub.add_parser("seed", help="load the default countries, products and payment methods into empty tables")
+    sub.add_parser("serve-shards", help="webhook ingress plus SHARD_COUNT worker processes")
+    sub.add_parser("shard-worker", help="one worker of serve-shards (started by it)")
+    reshard_parser = sub.add_parser("reshard", help="move the data into a new number of shards (bot stopped)")
+    reshard_parser.add_argument("shards", type=int)
+
+    import_stock = sub.add_parser("import-stock", help="load inventory items from a CSV or JSONL file")
+    import_stock.add_argument("path")
+    import_stock.add_argument("product_type", choices=sorted(PRODUCT_TABLES))
+    import_stock.add_argument("product_id", type=int)
+    import_stock.add_argument("--format", choices=("csv", "jsonl"))
+
+    args = parser.parse_args(argv)
+    if args.command == "import-stock":
+        import_stock_command(args)
+    elif args.command == "migrate":
+        migrate_command(args)
+    elif args.command == "seed":
+        seed_command(args)
+    elif args.command == "serve-shards":
+        serve_shards_command(args)
+    elif args.command == "shard-worker":
+        shard_worker_command(args)
+    elif args.command == "reshard":
+        reshard_command(args)
+    else:
+        main()
 
 if __name__ == "__main__":
-    main()
+    cli()